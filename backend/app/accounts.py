@@ -0,0 +1,266 @@
+"""
+Multi-account submission scheduler
+Spreads TCS submissions over a pool of accounts, each with its own cookies or
+credentials, per-account concurrency and rate limits, and an error cooldown
+"""
+import os
+import json
+import time
+import asyncio
+from typing import Dict, List, Optional
+from admission import Overloaded
+from tcs_submitter import TCSSubmitter
+from structured_log import get_logger
+
+logger = get_logger(__name__)
+
+# Submission failures that point at the account itself (rejected login) cool it down at once.
+# Agent failures and errors may also mean expired cookies (the agent then finds itself logged
+# out), so they cool the account down after max_errors in a row. 'no_prices' never counts.
+ACCOUNT_FAILURES = {'login'}
+HARMLESS_FAILURES = {'no_prices'}
+
+
+class TCSAccount:
+    def __init__(
+        self,
+        name: str,
+        cookies: Optional[Dict] = None,
+        username: str = None,
+        password: str = None,
+        max_concurrent: int = 1,
+        min_interval: float = 30.0
+    ):
+        """
+        One TCS identity and its scheduling state
+
+        Args:
+            name: Label used in logs and stats (never the credentials)
+            cookies: Session cookies for this account (preferred)
+            username: TCS username (fallback)
+            password: TCS password (fallback)
+            max_concurrent: Submissions allowed in parallel on this account
+            min_interval: Minimum seconds between two submission starts
+        """
+        self.name = name
+        self.cookies = cookies
+        self.username = username
+        self.password = password
+        self.max_concurrent = max_concurrent
+        self.min_interval = min_interval
+
+        self.in_flight = 0
+        self.last_started = 0.0
+        self.cooldown_until = 0.0
+        self.consecutive_errors = 0
+        self.submitted = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.created = time.monotonic()
+
+    def ready_at(self) -> float:
+        """Monotonic time from which this account may start another submission"""
+        return max(self.cooldown_until, self.last_started + self.min_interval)
+
+    def is_ready(self, now: float) -> bool:
+        return self.in_flight < self.max_concurrent and now >= self.ready_at()
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        uptime_hours = max(now - self.created, 1.0) / 3600
+        return {
+            'in_flight': self.in_flight,
+            'submitted': self.submitted,
+            'succeeded': self.succeeded,
+            'failed': self.failed,
+            'submissions_per_hour': round(self.submitted / uptime_hours, 2),
+            'avg_duration_s': round(self.busy_seconds / self.submitted, 1) if self.submitted else None,
+            'consecutive_errors': self.consecutive_errors,
+            'cooldown_remaining_s': round(max(0.0, self.cooldown_until - now), 1),
+        }
+
+
+def load_accounts() -> List[TCSAccount]:
+    """
+    Accounts from TCS_ACCOUNTS (JSON list of {"name", "cookies" | "username"/"password"}),
+    falling back to the single TCS_COOKIES / TCS_USERNAME / TCS_PASSWORD identity
+    """
+    max_concurrent = int(os.getenv('SUBMIT_ACCOUNT_MAX_CONCURRENT', '1'))
+    min_interval = float(os.getenv('SUBMIT_ACCOUNT_MIN_INTERVAL', '30'))
+
+    accounts_json = os.getenv('TCS_ACCOUNTS')
+    if accounts_json:
+        try:
+            entries = json.loads(accounts_json)
+            return [
+                TCSAccount(
+                    name=entry.get('name') or f'account-{index + 1}',
+                    cookies=entry.get('cookies'),
+                    username=entry.get('username'),
+                    password=entry.get('password'),
+                    max_concurrent=int(entry.get('max_concurrent', max_concurrent)),
+                    min_interval=float(entry.get('min_interval', min_interval)),
+                )
+                for index, entry in enumerate(entries)
+                if entry.get('cookies') or (entry.get('username') and entry.get('password'))
+            ]
+        except (json.JSONDecodeError, AttributeError, TypeError, ValueError):
+            logger.warning("TCS_ACCOUNTS is not a valid JSON list of accounts")
+
+    # Single identity from the environment
+    cookies = None
+    cookies_json = os.getenv('TCS_COOKIES')
+    if cookies_json:
+        try:
+            cookies = json.loads(cookies_json)
+        except json.JSONDecodeError:
+            logger.warning("TCS_COOKIES is not valid JSON")
+    username = os.getenv('TCS_USERNAME')
+    password = os.getenv('TCS_PASSWORD')
+
+    if cookies or (username and password):
+        return [TCSAccount('default', cookies, username, password, max_concurrent, min_interval)]
+    return []
+
+
+class AccountScheduler:
+    def __init__(self, accounts: List[TCSAccount], max_wait: float = 60.0,
+                 cooldown_base: float = 60.0, cooldown_max: float = 1800.0, max_errors: int = 3):
+        """
+        Args:
+            accounts: Account pool
+            max_wait: Seconds a job waits for a free account before it is rejected
+            cooldown_base: Cooldown after the first error, doubled per consecutive error
+            cooldown_max: Upper bound for the cooldown
+            max_errors: Consecutive agent failures/errors before an account cools down
+        """
+        self.accounts = accounts
+        self.max_wait = max_wait
+        self.cooldown_base = cooldown_base
+        self.cooldown_max = cooldown_max
+        self.max_errors = max(1, max_errors)
+        self._changed = asyncio.Condition()
+
+    def _pick(self, now: float) -> Optional[TCSAccount]:
+        ready = [account for account in self.accounts if account.is_ready(now)]
+        if not ready:
+            return None
+        # Least loaded first, then the one that has done the least work
+        return min(ready, key=lambda account: (account.in_flight / account.max_concurrent, account.submitted))
+
+    async def _acquire(self) -> TCSAccount:
+        deadline = time.monotonic() + self.max_wait
+        async with self._changed:
+            while True:
+                now = time.monotonic()
+                account = self._pick(now)
+                if account:
+                    account.in_flight += 1
+                    account.last_started = now
+                    return account
+
+                if now >= deadline:
+                    free = [a for a in self.accounts if a.in_flight < a.max_concurrent]
+                    next_ready = min((a.ready_at() for a in free), default=now + self.max_wait)
+                    raise Overloaded('submission', max(1, int(next_ready - now + 0.5)))
+
+                # Wake up when a slot frees or the next account leaves its rate limit/cooldown
+                free = [a for a in self.accounts if a.in_flight < a.max_concurrent]
+                wake_at = min([a.ready_at() for a in free] + [deadline])
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout=max(0.05, wake_at - now))
+                except asyncio.TimeoutError:
+                    pass
+
+    def reserve_nowait(self) -> Optional[TCSAccount]:
+        """Take an account only if one is ready right now (for speculative work)"""
+        account = self._pick(time.monotonic())
+        if account:
+            account.in_flight += 1
+            account.last_started = time.monotonic()
+        return account
+
+    async def release(self, account: TCSAccount):
+        """Give back a reserved account without counting a submission"""
+        async with self._changed:
+            account.in_flight -= 1
+            self._changed.notify_all()
+
+    async def _release(self, account: TCSAccount, success: bool, duration: float, failure: Optional[str] = None):
+        async with self._changed:
+            account.in_flight -= 1
+            account.submitted += 1
+            account.busy_seconds += duration
+            if success:
+                account.succeeded += 1
+                account.consecutive_errors = 0
+            else:
+                account.failed += 1
+            if not success and failure not in HARMLESS_FAILURES:
+                account.consecutive_errors += 1
+                if failure in ACCOUNT_FAILURES:
+                    doublings = account.consecutive_errors - 1
+                else:
+                    doublings = account.consecutive_errors - self.max_errors
+                if doublings >= 0:
+                    cooldown = min(self.cooldown_max, self.cooldown_base * 2 ** doublings)
+                    account.cooldown_until = time.monotonic() + cooldown
+                    logger.warning("Account %s failed %d time(s) in a row (%s), cooling down for %ds",
+                                   account.name, account.consecutive_errors, failure, cooldown)
+            self._changed.notify_all()
+
+    async def submit(
+        self,
+        latitude: float,
+        longitude: float,
+        prices: Dict[str, float],
+        account: Optional[TCSAccount] = None,
+        submitter: Optional[TCSSubmitter] = None
+    ) -> bool:
+        """
+        Submit prices on the next available account, or on an already reserved
+        account with its prepared submitter (see session_prepare)
+        """
+        if account is None:
+            account = await self._acquire()
+        logger.info("Submitting with account %s", account.name)
+        started = time.monotonic()
+        success = False
+        # Anything that ends without a recorded reason (exceptions) counts as 'error'
+        failure = 'error'
+        try:
+            if submitter is None:
+                submitter = TCSSubmitter(cookies=account.cookies, username=account.username, password=account.password)
+            async with submitter:
+                success = await submitter.submit_prices(
+                    latitude=latitude,
+                    longitude=longitude,
+                    benzin_95=prices.get('benzin_95'),
+                    benzin_98=prices.get('benzin_98'),
+                    diesel=prices.get('diesel')
+                )
+            failure = submitter.last_failure or 'error'
+            return success
+        finally:
+            await self._release(account, success, time.monotonic() - started, failure)
+
+    def stats(self) -> Dict[str, Dict]:
+        return {account.name: account.stats() for account in self.accounts}
+
+
+_scheduler: Optional[AccountScheduler] = None
+
+
+def get_account_scheduler() -> AccountScheduler:
+    """Shared scheduler over the accounts configured in the environment"""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = AccountScheduler(
+            load_accounts(),
+            max_wait=float(os.getenv('SUBMIT_ACCOUNT_WAIT', '60')),
+            cooldown_base=float(os.getenv('SUBMIT_ACCOUNT_COOLDOWN', '60')),
+            cooldown_max=float(os.getenv('SUBMIT_ACCOUNT_COOLDOWN_MAX', '1800')),
+            max_errors=int(os.getenv('SUBMIT_ACCOUNT_MAX_ERRORS', '3')),
+        )
+    return _scheduler
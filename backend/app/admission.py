@@ -0,0 +1,154 @@
+"""
+Admission control for expensive pipeline stages
+Limits concurrency per stage (OCR, vision API, TCS submission) with a bounded wait queue
+so that bursts fail fast with 503 instead of exhausting memory or CPU
+"""
+import os
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+
+class Overloaded(Exception):
+    """Raised when a stage cannot admit more work"""
+
+    def __init__(self, stage: str, retry_after: int):
+        super().__init__(f"{stage} stage is overloaded, retry in {retry_after}s")
+        self.stage = stage
+        self.retry_after = retry_after
+
+
+class StageLimiter:
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, queue_timeout: float):
+        """
+        Concurrency limiter with a bounded queue for one pipeline stage
+
+        Args:
+            name: Stage name used in errors and stats
+            max_concurrent: Number of jobs allowed to run at the same time
+            max_queue: Number of jobs allowed to wait for a free slot
+            queue_timeout: Seconds a job may wait before it is rejected
+        """
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self.running = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.last_wait = 0.0
+        self.max_wait = 0.0
+        self._avg_wait = 0.0
+        self._avg_service = 0.0
+
+    def retry_after(self) -> int:
+        """Estimate seconds until a slot frees up, based on average service time"""
+        service = self._avg_service or 5.0
+        rounds = (self.waiting + 1) / self.max_concurrent
+        return max(1, int(service * rounds + 0.5))
+
+    def has_capacity(self) -> bool:
+        """True if a new job would currently be admitted (running or queued)"""
+        return self.running + self.waiting < self.max_concurrent + self.max_queue
+
+    def ensure_capacity(self):
+        """Fail fast before doing any work if the stage is already saturated"""
+        if not self.has_capacity():
+            self.rejected += 1
+            raise Overloaded(self.name, self.retry_after())
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one concurrency slot of this stage for the duration of the block"""
+        self.ensure_capacity()
+
+        self.waiting += 1
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise Overloaded(self.name, self.retry_after())
+        finally:
+            self.waiting -= 1
+
+        waited = time.monotonic() - started
+        self.last_wait = waited
+        self.max_wait = max(self.max_wait, waited)
+        self._avg_wait = waited if not self.admitted else 0.8 * self._avg_wait + 0.2 * waited
+        self.admitted += 1
+        self.running += 1
+
+        service_started = time.monotonic()
+        try:
+            yield
+        finally:
+            service = time.monotonic() - service_started
+            self._avg_service = service if not self._avg_service else 0.8 * self._avg_service + 0.2 * service
+            self.running -= 1
+            self._semaphore.release()
+
+    async def try_acquire(self, keep_free: int = 0) -> bool:
+        """
+        Take a slot only if one is free right now, without queueing (for
+        speculative work that outlives a request), leaving at least `keep_free`
+        slots for regular jobs. Give it back with release().
+        """
+        if self.waiting or self._semaphore.locked() or self.max_concurrent - self.running <= keep_free:
+            return False
+        await self._semaphore.acquire()  # returns immediately, the semaphore is not locked
+        self.admitted += 1
+        self.running += 1
+        return True
+
+    def release(self):
+        """Return a slot taken with try_acquire()"""
+        self.running -= 1
+        self._semaphore.release()
+
+    def stats(self) -> Dict:
+        """Current queue depth, wait times and counters"""
+        return {
+            'running': self.running,
+            'waiting': self.waiting,
+            'max_concurrent': self.max_concurrent,
+            'max_queue': self.max_queue,
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+            'avg_wait_ms': round(self._avg_wait * 1000, 1),
+            'last_wait_ms': round(self.last_wait * 1000, 1),
+            'max_wait_ms': round(self.max_wait * 1000, 1),
+            'avg_service_ms': round(self._avg_service * 1000, 1),
+        }
+
+
+def _limiter_from_env(name: str, prefix: str, concurrent: int, queue: int, timeout: float) -> StageLimiter:
+    return StageLimiter(
+        name=name,
+        max_concurrent=max(1, int(os.getenv(f'{prefix}_MAX_CONCURRENT', concurrent))),
+        max_queue=max(0, int(os.getenv(f'{prefix}_MAX_QUEUE', queue))),
+        queue_timeout=float(os.getenv(f'{prefix}_QUEUE_TIMEOUT', timeout)),
+    )
+
+
+_limiters: Dict[str, StageLimiter] = {}
+
+
+def get_limiter(stage: str) -> Optional[StageLimiter]:
+    """Return the shared limiter for 'ocr', 'vision' or 'submission', created on first use"""
+    if not _limiters:
+        # Image decoding and Tesseract are CPU bound
+        _limiters['ocr'] = _limiter_from_env('ocr', 'OCR', os.cpu_count() or 2, 16, 30.0)
+        # Vision API calls only wait on the network, bounded for the OpenRouter rate limit
+        _limiters['vision'] = _limiter_from_env('vision', 'VISION', 8, 32, 30.0)
+        _limiters['submission'] = _limiter_from_env('submission', 'SUBMIT', 1, 4, 120.0)
+    return _limiters.get(stage)
+
+
+def admission_stats() -> Dict[str, Dict]:
+    """Stats of all stages, keyed by stage name"""
+    get_limiter('ocr')
+    return {name: limiter.stats() for name, limiter in _limiters.items()}
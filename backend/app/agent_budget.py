@@ -0,0 +1,182 @@
+"""
+Step, time and token budgets for browser-use agent runs
+Stops runaway agents and records per-step telemetry for every run
+"""
+import os
+import time
+import asyncio
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional
+from structured_log import get_logger
+
+logger = get_logger(__name__)
+
+
+# Only the attributes the agent needs to find login fields and price dialogs
+LEAN_INCLUDE_ATTRIBUTES = [
+    'title',
+    'type',
+    'name',
+    'role',
+    'aria-label',
+    'placeholder',
+    'value',
+]
+
+
+class AgentBudget:
+    def __init__(self, max_steps: int, max_seconds: float, max_tokens: int):
+        """
+        Limits for a single agent run
+
+        Args:
+            max_steps: Maximum number of agent steps (LLM round trips)
+            max_seconds: Wall time limit for the whole run
+            max_tokens: Limit on the summed input tokens of all steps
+        """
+        self.max_steps = max_steps
+        self.max_seconds = max_seconds
+        self.max_tokens = max_tokens
+
+    @classmethod
+    def from_env(cls, kind: str) -> 'AgentBudget':
+        """Read AGENT_<KIND>_MAX_STEPS / _MAX_SECONDS / _MAX_TOKENS, e.g. kind='login'"""
+        prefix = f'AGENT_{kind.upper()}'
+        defaults = {'login': (15, 120, 150_000), 'submit': (25, 240, 300_000), 'prepare': (6, 60, 60_000)}
+        steps, seconds, tokens = defaults.get(kind, defaults['submit'])
+        return cls(
+            max_steps=int(os.getenv(f'{prefix}_MAX_STEPS', steps)),
+            max_seconds=float(os.getenv(f'{prefix}_MAX_SECONDS', seconds)),
+            max_tokens=int(os.getenv(f'{prefix}_MAX_TOKENS', tokens)),
+        )
+
+
+def agent_settings() -> Dict:
+    """Agent kwargs that keep the page context sent to the LLM small"""
+    return {
+        'use_vision': os.getenv('AGENT_USE_VISION', 'true').lower() == 'true',
+        'max_input_tokens': int(os.getenv('AGENT_MAX_INPUT_TOKENS', '32000')),
+        'max_actions_per_step': int(os.getenv('AGENT_MAX_ACTIONS_PER_STEP', '4')),
+        'include_attributes': LEAN_INCLUDE_ATTRIBUTES,
+    }
+
+
+def session_settings() -> Dict:
+    """BrowserSession kwargs that limit the DOM serialised per step to the visible region"""
+    return {
+        'viewport_expansion': int(os.getenv('AGENT_VIEWPORT_EXPANSION', '0')),
+        'highlight_elements': False,
+    }
+
+
+_recent_runs: Deque[Dict] = deque(maxlen=int(os.getenv('AGENT_RUN_HISTORY', '50')))
+
+
+def recent_runs() -> List[Dict]:
+    """Records of the most recent agent runs, slowest first"""
+    return sorted(_recent_runs, key=lambda run: run['duration_ms'], reverse=True)
+
+
+class AgentRunRecorder:
+    def __init__(self, name: str, budget: AgentBudget):
+        """
+        Collects per-step telemetry for one agent run and enforces the budget
+
+        Args:
+            name: Run kind used in the record ('login', 'submit')
+            budget: Limits to enforce
+        """
+        self.name = name
+        self.budget = budget
+        self.steps: List[Dict] = []
+        self.tokens = 0
+        self.started = None
+        self.stop_reason: Optional[str] = None
+        self.record: Optional[Dict] = None
+
+    async def on_step_end(self, agent):
+        """browser-use on_step_end hook: record the step and stop the agent when over budget"""
+        history = agent.state.history.history
+        if not history:
+            return
+        item = history[-1]
+        metadata = item.metadata
+        input_tokens = metadata.input_tokens if metadata else 0
+        self.tokens += input_tokens
+
+        actions = []
+        if item.model_output:
+            actions = [next(iter(action.model_dump(exclude_unset=True)), '?') for action in item.model_output.action]
+        errors = [result.error for result in item.result if result.error]
+
+        self.steps.append({
+            'step': metadata.step_number if metadata else len(self.steps) + 1,
+            'input_tokens': input_tokens,
+            'latency_ms': round(metadata.duration_seconds * 1000) if metadata else None,
+            'actions': actions,
+            'error': errors[0][:200] if errors else None,
+        })
+
+        if self.tokens > self.budget.max_tokens:
+            self.stop_reason = 'token_budget'
+        elif time.monotonic() - self.started > self.budget.max_seconds:
+            self.stop_reason = 'time_budget'
+        if self.stop_reason:
+            logger.warning("Agent '%s' over budget (%s), stopping", self.name, self.stop_reason)
+            agent.stop()
+
+    async def run(self, agent):
+        """Run the agent within the budget and return its history (None on timeout)"""
+        self.started = time.monotonic()
+        history = None
+        error = None
+        try:
+            # The step hook only fires between steps, the hard timeout also covers a hung step
+            history = await asyncio.wait_for(
+                agent.run(max_steps=self.budget.max_steps, on_step_end=self.on_step_end),
+                timeout=self.budget.max_seconds + 15
+            )
+        except asyncio.TimeoutError:
+            self.stop_reason = 'timeout'
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            self._finish(history, error)
+        return history
+
+    def _outcome(self, history, error: Optional[str]) -> str:
+        if error:
+            return 'error'
+        if self.stop_reason:
+            return self.stop_reason
+        if history is None:
+            return 'error'
+        if not history.is_done():
+            return 'max_steps'
+        return 'success' if history.is_successful() is not False else 'failed'
+
+    def _finish(self, history, error: Optional[str]):
+        self.record = {
+            'run': self.name,
+            'finished_at': datetime.now().isoformat(),
+            'outcome': self._outcome(history, error),
+            'duration_ms': round((time.monotonic() - self.started) * 1000),
+            'steps': len(self.steps),
+            'input_tokens': self.tokens,
+            'budget': {
+                'max_steps': self.budget.max_steps,
+                'max_seconds': self.budget.max_seconds,
+                'max_tokens': self.budget.max_tokens,
+            },
+            'step_log': self.steps,
+        }
+        if error:
+            self.record['error'] = error[:500]
+        _recent_runs.append(self.record)
+        logger.info("agent_run", extra={'fields': {'event': 'agent_run', **self.record}})
+
+    @property
+    def succeeded(self) -> bool:
+        return bool(self.record) and self.record['outcome'] == 'success'
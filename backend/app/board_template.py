@@ -0,0 +1,336 @@
+"""
+Station board templates
+A station's price board looks the same on every visit. After a confident
+extraction we learn where each price row sits, which fuel it shows and how its
+digits are written, keyed by the station cell. Later uploads from that cell
+read only those rows with single-line Tesseract and skip the vision call when
+every row reads cleanly; a template that keeps missing is dropped and relearned.
+"""
+import io
+import os
+import re
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+import pytesseract
+from PIL import Image, ImageEnhance, ImageFilter
+from models import PriceData
+from admission import get_limiter
+from price_store import (
+    GEOHASH_PRECISION, STATION_PRECISION, geohash_encode, covering_prefixes, haversine_km, _bounding_box
+)
+from structured_log import PAYLOAD, get_logger
+from profiling import to_thread
+
+logger = get_logger(__name__)
+
+# Label words left of a price, checked in this order (98 before 95: "Super Plus 98")
+_FUEL_LABELS = [
+    ('Benzin 98', ('98', 'superplus', 'super plus', 'v-power', 'vpower')),
+    ('Benzin 95', ('95', 'bleifrei', 'sans plomb', 'senza piombo', 'unleaded')),
+    ('Diesel', ('diesel', 'gasoil', 'gazole')),
+]
+
+_DIGITS_CONFIG = r'--oem 3 --psm 11 -c tessedit_char_whitelist=0123456789.,'
+_ROW_CONFIG = r'--oem 3 --psm 7 -c tessedit_char_whitelist=0123456789.,'
+_LABEL_CONFIG = r'--oem 3 --psm 11'
+
+# Padding around a learned price box (fraction of its size) to tolerate slightly different framing
+_PAD_X = 0.25
+_PAD_Y = 0.4
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS board_templates (
+    station_cell TEXT PRIMARY KEY,
+    latitude REAL NOT NULL,
+    longitude REAL NOT NULL,
+    geohash TEXT NOT NULL,
+    rows TEXT NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    misses INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_templates_geohash ON board_templates (geohash);
+"""
+
+
+def _digits_image(img: Image.Image) -> Image.Image:
+    """Same preprocessing as the Tesseract digits strategy"""
+    gray = img.convert('L').filter(ImageFilter.SHARPEN)
+    gray = ImageEnhance.Contrast(gray).enhance(3.0)
+    return ImageEnhance.Brightness(gray).enhance(1.2)
+
+
+def _digit_format(token: str) -> str:
+    """'1.869' -> 'd.ddd', '186' -> 'ddd'"""
+    return re.sub(r'\d', 'd', token.replace(',', '.'))
+
+
+def parse_with_format(text: str, fmt: str) -> Optional[float]:
+    """
+    Read a price in the known digit format of its row. The decimal point is
+    placed by the format, so LED boards without a visible point still parse.
+    Returns None unless the text has exactly the expected number of digits.
+    """
+    digits = re.sub(r'\D', '', text)
+    if len(digits) != fmt.count('d') or len(digits) < 2:
+        return None
+    value = float(f'{digits[0]}.{digits[1:]}')
+    return value if 1.0 <= value <= 3.0 else None
+
+
+def _matches(token: str, value: float) -> bool:
+    """True if an OCR word shows this price, with or without decimal point"""
+    token = token.replace(',', '.').strip('.')
+    digits = re.sub(r'\D', '', token)
+    if len(digits) < 3:
+        return False
+    if '.' in token:
+        try:
+            return abs(float(token) - value) < 0.0005
+        except ValueError:
+            return False
+    return abs(float(f'{digits[0]}.{digits[1:]}') - value) < 0.0005
+
+
+def _label_for(words: List[Dict], box: Tuple[int, int, int, int]) -> Optional[str]:
+    """Fuel type from the words on the same line left of the price box"""
+    left, top, width, height = box
+    line = ' '.join(
+        word['text'].lower() for word in words
+        if word['left'] + word['width'] <= left + width * 0.1
+        and word['top'] < top + height and word['top'] + word['height'] > top
+    )
+    for fuel, keywords in _FUEL_LABELS:
+        if any(keyword in line for keyword in keywords):
+            return fuel
+    return None
+
+
+def _words(img: Image.Image, **kwargs) -> List[Dict]:
+    data = pytesseract.image_to_data(img, output_type=pytesseract.Output.DICT, **kwargs)
+    return [
+        {key: data[key][i] for key in ('text', 'left', 'top', 'width', 'height')}
+        for i in range(len(data['text']))
+        if data['text'][i].strip()
+    ]
+
+
+def learn_template(image_bytes: bytes, prices: List[PriceData]) -> Optional[List[Dict]]:
+    """
+    Locate each extracted price on the board (blocking, run in a worker thread).
+    Returns template rows top to bottom, or None unless every price was found
+    in reading order. Fuel types come from the board labels where readable,
+    otherwise from the extraction.
+    """
+    img = Image.open(io.BytesIO(image_bytes))
+    width, height = img.size
+    words = _words(_digits_image(img), config=_DIGITS_CONFIG)
+    logger.info("Template learning words: %s", [word['text'] for word in words], extra=PAYLOAD)
+
+    located = []
+    used = set()
+    for price in prices:
+        candidates = [
+            (index, word) for index, word in enumerate(words)
+            if index not in used and _matches(word['text'], price.value)
+        ]
+        if not candidates:
+            return None
+        index, word = min(candidates, key=lambda candidate: candidate[1]['top'])
+        used.add(index)
+        located.append((price, word))
+
+    tops = [word['top'] for _, word in located]
+    if tops != sorted(tops):
+        return None
+
+    labels = _words(img.convert('L'), lang='deu+fra+ita', config=_LABEL_CONFIG)
+    rows = []
+    for price, word in located:
+        box = (word['left'], word['top'], word['width'], word['height'])
+        pad_x, pad_y = word['width'] * _PAD_X, word['height'] * _PAD_Y
+        left = max(0.0, (word['left'] - pad_x) / width)
+        top = max(0.0, (word['top'] - pad_y) / height)
+        right = min(1.0, (word['left'] + word['width'] + pad_x) / width)
+        bottom = min(1.0, (word['top'] + word['height'] + pad_y) / height)
+        rows.append({
+            'fuel': _label_for(labels, box) or price.type,
+            'box': [round(left, 4), round(top, 4), round(right - left, 4), round(bottom - top, 4)],
+            'format': _digit_format(word['text'].strip('.,')),
+        })
+    return rows
+
+
+def read_template(img: Image.Image, rows: List[Dict]) -> Optional[List[PriceData]]:
+    """
+    Single-line OCR of each learned row (blocking, run in a worker thread).
+    Returns None as soon as one row does not read cleanly in its digit format.
+    """
+    width, height = img.size
+    prices = []
+    for row in rows:
+        x, y, w, h = row['box']
+        crop = img.crop((int(x * width), int(y * height), int((x + w) * width), int((y + h) * height)))
+        # Tesseract wants digits of roughly 30+ px height
+        if crop.height and crop.height < 60:
+            scale = 60 / crop.height
+            crop = crop.resize((max(1, int(crop.width * scale)), 60), Image.LANCZOS)
+        text = pytesseract.image_to_string(_digits_image(crop), config=_ROW_CONFIG)
+        value = parse_with_format(text, row['format'])
+        if value is None:
+            logger.info("Template row %s unreadable: %r", row['fuel'], text.strip(), extra=PAYLOAD)
+            return None
+        prices.append(PriceData(type=row['fuel'], value=value))
+    return prices
+
+
+def relabel(prices: List[PriceData], rows: List[Dict]) -> List[PriceData]:
+    """Use the station's known fuel order instead of guessing it from the price count"""
+    if len(prices) != len(rows):
+        return prices
+    return [PriceData(type=row['fuel'], value=price.value) for price, row in zip(prices, rows)]
+
+
+class TemplateStore:
+    def __init__(self, path: str, max_distance_m: float = 60.0, max_misses: int = 3):
+        """
+        Args:
+            path: SQLite database file (':memory:' for tests)
+            max_distance_m: Templates further away from the upload are not used
+            max_misses: Consecutive unreadable uploads after which a template is dropped
+        """
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.max_distance_m = max_distance_m
+        self.max_misses = max_misses
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.executescript(_SCHEMA)
+            self._conn.commit()
+        self.lookups = 0
+        self.reads = 0
+        self.misses = 0
+        self.learned = 0
+
+    def find(self, latitude: float, longitude: float) -> Optional[Dict]:
+        """Nearest template within max_distance_m of the position"""
+        self.lookups += 1
+        min_lat, max_lat, min_lon, max_lon = _bounding_box(latitude, longitude, self.max_distance_m / 1000)
+        rows = []
+        with self._lock:
+            for prefix in covering_prefixes(min_lat, max_lat, min_lon, max_lon):
+                rows.extend(self._conn.execute(
+                    'SELECT * FROM board_templates WHERE geohash >= ? AND geohash < ? '
+                    'AND latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?',
+                    (prefix, prefix + '{', min_lat, max_lat, min_lon, max_lon)
+                ).fetchall())
+
+        best = None
+        best_distance = self.max_distance_m
+        for row in rows:
+            distance = haversine_km(latitude, longitude, row['latitude'], row['longitude']) * 1000
+            if distance <= best_distance:
+                best, best_distance = row, distance
+        if best is None:
+            return None
+        return {
+            'station_cell': best['station_cell'],
+            'latitude': best['latitude'],
+            'longitude': best['longitude'],
+            'rows': json.loads(best['rows']),
+            'hits': best['hits'],
+            'misses': best['misses'],
+            'updated_at': best['updated_at'],
+        }
+
+    def save(self, latitude: float, longitude: float, rows: List[Dict], station_cell: Optional[str] = None):
+        """Store learned rows, replacing the template of station_cell (default: the position's cell)"""
+        station_cell = station_cell or geohash_encode(latitude, longitude, STATION_PRECISION)
+        with self._lock:
+            self._conn.execute(
+                'INSERT INTO board_templates (station_cell, latitude, longitude, geohash, rows, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(station_cell) DO UPDATE SET latitude = excluded.latitude, '
+                'longitude = excluded.longitude, geohash = excluded.geohash, rows = excluded.rows, '
+                'misses = 0, updated_at = excluded.updated_at',
+                (station_cell, latitude, longitude, station_cell[:GEOHASH_PRECISION], json.dumps(rows), time.time())
+            )
+            self._conn.commit()
+        self.learned += 1
+
+    def record(self, station_cell: str, hit: bool):
+        """Count a template read; drop the template after max_misses misses in a row"""
+        with self._lock:
+            if hit:
+                self.reads += 1
+                self._conn.execute(
+                    'UPDATE board_templates SET hits = hits + 1, misses = 0 WHERE station_cell = ?', (station_cell,)
+                )
+            else:
+                self.misses += 1
+                self._conn.execute(
+                    'UPDATE board_templates SET misses = misses + 1 WHERE station_cell = ?', (station_cell,)
+                )
+                self._conn.execute(
+                    'DELETE FROM board_templates WHERE station_cell = ? AND misses >= ?',
+                    (station_cell, self.max_misses)
+                )
+            self._conn.commit()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            templates = self._conn.execute('SELECT COUNT(*) FROM board_templates').fetchone()[0]
+        return {
+            'templates': templates,
+            'lookups': self.lookups,
+            'reads': self.reads,
+            'misses': self.misses,
+            'learned': self.learned,
+        }
+
+
+_store: Optional[TemplateStore] = None
+_learning = set()
+
+
+def get_template_store() -> TemplateStore:
+    """Shared store in the PRICE_DB_PATH database, see TEMPLATE_MAX_DISTANCE_M / TEMPLATE_MAX_MISSES"""
+    global _store
+    if _store is None:
+        _store = TemplateStore(
+            os.getenv('PRICE_DB_PATH', 'data/prices.db'),
+            max_distance_m=float(os.getenv('TEMPLATE_MAX_DISTANCE_M', '60')),
+            max_misses=int(os.getenv('TEMPLATE_MAX_MISSES', '3')),
+        )
+    return _store
+
+
+def schedule_learning(image_bytes: bytes, prices: List[PriceData], latitude: float, longitude: float,
+                      station_cell: Optional[str] = None):
+    """Learn a template from a confident extraction in the background, only while OCR has spare capacity"""
+    if not prices or not get_limiter('ocr').has_capacity():
+        return
+    task = asyncio.ensure_future(_learn(image_bytes, prices, latitude, longitude, station_cell))
+    _learning.add(task)
+    task.add_done_callback(_learning.discard)
+
+
+async def _learn(image_bytes: bytes, prices: List[PriceData], latitude: float, longitude: float,
+                 station_cell: Optional[str]):
+    try:
+        async with get_limiter('ocr').slot():
+            rows = await to_thread(learn_template, image_bytes, prices)
+        if rows is None:
+            logger.info("No template learned, prices not found on the board")
+            return
+        await to_thread(get_template_store().save, latitude, longitude, rows, station_cell)
+        logger.info("Learned board template: %s", [(row['fuel'], row['format']) for row in rows])
+    except Exception as e:
+        logger.warning("Template learning failed: %s", e)
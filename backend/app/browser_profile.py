@@ -0,0 +1,244 @@
+"""
+Lean browser profile for the submission agent
+Blocks analytics and ads at the DNS level (Chromium host resolver rules) and
+leases persistent disk cache directories so static site assets survive across
+sessions. Blocking by resource type needs request interception, which turns
+off Chromium's HTTP cache for the context, so it is opt-in.
+"""
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+
+# Third-party hosts that are never needed to submit a price
+DEFAULT_BLOCKED_HOSTS = [
+    'google-analytics.com',
+    'googletagmanager.com',
+    'doubleclick.net',
+    'googlesyndication.com',
+    'googleadservices.com',
+    'facebook.net',
+    'facebook.com',
+    'hotjar.com',
+    'hotjar.io',
+    'clarity.ms',
+    'bing.com',
+    'linkedin.com',
+    'criteo.com',
+    'taboola.com',
+    'outbrain.com',
+    'adnxs.com',
+    'onetrust.com',
+    'cookielaw.org',
+    'usercentrics.eu',
+    'newrelic.com',
+    'nr-data.net',
+    'sentry.io',
+]
+
+# Resource types blocked unless they come from an essential host.
+# Empty by default: blocking by type intercepts every request, and Playwright
+# disables the HTTP cache of an intercepted context.
+DEFAULT_BLOCKED_TYPES: List[str] = []
+
+# Hosts the agent needs to see fully (site itself and the Azure B2C login)
+DEFAULT_ESSENTIAL_HOSTS = ['tcs.ch', 'b2clogin.com']
+
+# Rough transfer size of a blocked request by resource type, used for the savings report
+TYPICAL_BYTES = {
+    'image': 40_000,
+    'media': 500_000,
+    'font': 60_000,
+    'script': 80_000,
+    'stylesheet': 30_000,
+    'xhr': 5_000,
+    'fetch': 5_000,
+}
+
+
+def _env_list(name: str, default: List[str]) -> List[str]:
+    value = os.getenv(name)
+    if value is None:
+        return list(default)
+    return [item.strip().lower() for item in value.split(',') if item.strip()]
+
+
+def _host_matches(host: str, domains: List[str]) -> bool:
+    return any(host == domain or host.endswith('.' + domain) for domain in domains)
+
+
+class ResourcePolicy:
+    def __init__(
+        self,
+        blocked_hosts: Optional[List[str]] = None,
+        blocked_types: Optional[List[str]] = None,
+        essential_hosts: Optional[List[str]] = None
+    ):
+        """
+        Request blocking policy for a browser
+
+        Args:
+            blocked_hosts: Domains that never resolve (analytics, ads), see launch_args()
+            blocked_types: Playwright resource types aborted for non-essential hosts
+                (uses request interception, which disables the HTTP cache)
+            essential_hosts: Domains whose resources are never blocked by type
+        """
+        self.blocked_hosts = blocked_hosts if blocked_hosts is not None else list(DEFAULT_BLOCKED_HOSTS)
+        self.blocked_types = blocked_types if blocked_types is not None else list(DEFAULT_BLOCKED_TYPES)
+        self.essential_hosts = essential_hosts if essential_hosts is not None else list(DEFAULT_ESSENTIAL_HOSTS)
+        self.reset_stats()
+
+    @classmethod
+    def from_env(cls) -> 'ResourcePolicy':
+        """Build the policy from BROWSER_BLOCK_HOSTS / BROWSER_BLOCK_TYPES / BROWSER_ESSENTIAL_HOSTS"""
+        return cls(
+            blocked_hosts=_env_list('BROWSER_BLOCK_HOSTS', DEFAULT_BLOCKED_HOSTS),
+            blocked_types=_env_list('BROWSER_BLOCK_TYPES', DEFAULT_BLOCKED_TYPES),
+            essential_hosts=_env_list('BROWSER_ESSENTIAL_HOSTS', DEFAULT_ESSENTIAL_HOSTS),
+        )
+
+    def reset_stats(self):
+        self.requests_allowed = 0
+        self.requests_blocked = 0
+        self.bytes_loaded = 0
+        self.bytes_saved_estimate = 0
+        self.blocked_by_type: Dict[str, int] = {}
+
+    def launch_args(self) -> List[str]:
+        """Chromium flags that make the blocked hosts fail DNS resolution (keeps the HTTP cache on)"""
+        if not self.blocked_hosts:
+            return []
+        rules = []
+        for host in self.blocked_hosts:
+            rules.append(f'MAP {host} ~NOTFOUND')
+            rules.append(f'MAP *.{host} ~NOTFOUND')
+        return ['--host-resolver-rules=' + ', '.join(rules)]
+
+    def should_block(self, url: str, resource_type: str) -> bool:
+        """Decide whether a request is aborted"""
+        host = (urlparse(url).hostname or '').lower()
+        if not host:
+            return False
+        if _host_matches(host, self.blocked_hosts):
+            return True
+        if resource_type in self.blocked_types and not _host_matches(host, self.essential_hosts):
+            return True
+        return False
+
+    def _count_blocked(self, resource_type: str):
+        self.requests_blocked += 1
+        self.bytes_saved_estimate += TYPICAL_BYTES.get(resource_type, 10_000)
+        self.blocked_by_type[resource_type] = self.blocked_by_type.get(resource_type, 0) + 1
+
+    async def _handle_route(self, route):
+        request = route.request
+        if self.should_block(request.url, request.resource_type):
+            self._count_blocked(request.resource_type)
+            await route.abort('blockedbyclient')
+        else:
+            await route.continue_()
+
+    def _on_request_failed(self, request):
+        # Requests to blocked hosts fail in the resolver instead of being intercepted
+        host = (urlparse(request.url).hostname or '').lower()
+        if host and _host_matches(host, self.blocked_hosts):
+            self._count_blocked(request.resource_type)
+
+    def _on_response(self, response):
+        self.requests_allowed += 1
+        length = response.headers.get('content-length')
+        if length and length.isdigit():
+            self.bytes_loaded += int(length)
+
+    async def attach(self, context):
+        """
+        Install the statistics hooks on a Playwright BrowserContext whose browser
+        was launched with launch_args(); type blocking is routed only if configured
+        """
+        if self.blocked_types:
+            await context.route('**/*', self._handle_route)
+        context.on('requestfailed', self._on_request_failed)
+        context.on('response', self._on_response)
+
+    def report(self) -> Dict:
+        """Requests and bytes saved since the last reset"""
+        return {
+            'requests_allowed': self.requests_allowed,
+            'requests_blocked': self.requests_blocked,
+            'blocked_by_type': dict(self.blocked_by_type),
+            'bytes_loaded': self.bytes_loaded,
+            'bytes_saved_estimate': self.bytes_saved_estimate,
+        }
+
+
+# Chromium flags that reduce memory and background traffic per instance
+LEAN_CHROMIUM_ARGS = [
+    '--no-sandbox',
+    '--disable-dev-shm-usage',
+    '--disable-gpu',
+    '--disable-background-networking',
+    '--disable-component-update',
+    '--disable-default-apps',
+    '--disable-sync',
+    '--metrics-recording-only',
+    '--no-first-run',
+    '--mute-audio',
+]
+
+_free_cache_slots: List[int] = []
+_next_cache_slot = 0
+
+
+@contextmanager
+def lease_cache_dir():
+    """
+    Lease a persistent disk cache directory for one browser.
+
+    Chromium locks its cache directory, so concurrent browsers each get their
+    own slot under BROWSER_CACHE_DIR; slots are reused so cached static assets
+    of benzin.tcs.ch survive across sessions.
+    Yields None if BROWSER_CACHE_DIR is set to an empty string.
+    """
+    global _next_cache_slot
+
+    cache_root = os.getenv('BROWSER_CACHE_DIR', '/tmp/tcs-browser-cache')
+    if not cache_root:
+        yield None
+        return
+
+    if _free_cache_slots:
+        slot = _free_cache_slots.pop(0)
+    else:
+        slot = _next_cache_slot
+        _next_cache_slot += 1
+
+    cache_dir = os.path.join(cache_root, f'slot-{slot}')
+    os.makedirs(cache_dir, exist_ok=True)
+    try:
+        yield cache_dir
+    finally:
+        _free_cache_slots.append(slot)
+        _free_cache_slots.sort()
+
+
+def chromium_args(cache_dir: Optional[str] = None) -> List[str]:
+    """Launch args for a lean Chromium, optionally with a persistent disk cache"""
+    args = list(LEAN_CHROMIUM_ARGS)
+    if cache_dir:
+        cache_size = int(os.getenv('BROWSER_CACHE_SIZE_MB', '200')) * 1024 * 1024
+        args.append(f'--disk-cache-dir={cache_dir}')
+        args.append(f'--disk-cache-size={cache_size}')
+    return args
+
+
+@contextmanager
+def temp_profile_dir():
+    """Fresh throw-away user data dir, so cookies and sessions never leak between submitters"""
+    path = tempfile.mkdtemp(prefix='tcs-profile-')
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,148 @@
+"""
+Burst capture consensus
+A burst is a short sequence of frames of the same price board. Frames are read
+with the cheap local engine in parallel; as soon as enough frames agree on the
+same prices the remaining frames are cancelled. Only when they disagree is the
+sharpest frame escalated to the vision API.
+"""
+import os
+import asyncio
+import threading
+from collections import Counter
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from PIL import Image, ImageFilter, ImageStat
+from models import PriceData
+from admission import Overloaded, get_limiter
+from upload_profile import prepare_image
+from structured_log import get_logger
+from profiling import to_thread
+
+logger = get_logger(__name__)
+
+PriceKey = Tuple[Tuple[str, float], ...]
+
+
+def burst_settings() -> Dict:
+    """Burst shape and limits from BURST_FRAMES / BURST_MAX_FRAMES / BURST_AGREE / BURST_PARALLEL / BURST_INTERVAL_MS"""
+    return {
+        'frames': int(os.getenv('BURST_FRAMES', '1')),
+        'max_frames': int(os.getenv('BURST_MAX_FRAMES', '5')),
+        'agree': int(os.getenv('BURST_AGREE', '2')),
+        'parallel': int(os.getenv('BURST_PARALLEL', '2')),
+        'interval_ms': int(os.getenv('BURST_INTERVAL_MS', '150')),
+    }
+
+
+def price_key(prices: List[PriceData]) -> PriceKey:
+    """Comparable form of a price list (frames vote with this)"""
+    return tuple((price.type, round(price.value, 3)) for price in prices)
+
+
+def sharpness(img: Image.Image) -> float:
+    """Edge variance; blurry frames score low"""
+    gray = img.convert('L')
+    gray.thumbnail((400, 400))
+    return ImageStat.Stat(gray.filter(ImageFilter.FIND_EDGES)).var[0]
+
+
+class FrameResult:
+    def __init__(self, index: int, image_bytes: bytes, prices: List[PriceData], text: str, score: float):
+        self.index = index
+        self.image_bytes = image_bytes
+        self.prices = prices
+        self.text = text
+        self.sharpness = score
+
+
+class BurstResult:
+    def __init__(self, prices: List[PriceData], text: str, engine: str,
+                 frames_processed: int, agreeing_frames: int, image_bytes: bytes):
+        self.prices = prices
+        self.text = text
+        self.engine = engine
+        self.frames_processed = frames_processed
+        self.agreeing_frames = agreeing_frames
+        self.image_bytes = image_bytes
+
+
+async def run_burst(
+    frames: List[bytes],
+    crop_box: Optional[tuple],
+    agree: int,
+    parallel: int,
+    local_extract: Callable[[Image.Image], Tuple[List[PriceData], str]],
+    vision_extract: Callable[[bytes], Awaitable[Tuple[List[PriceData], str]]]
+) -> BurstResult:
+    """
+    Read frames with local_extract (blocking, run in worker threads, at most
+    `parallel` at once, each holding one OCR slot) until `agree` frames yield
+    the same non-empty prices.
+    Frames not yet started are cancelled; a frame already inside Tesseract
+    finishes in its thread, keeping its OCR slot, but its result is ignored.
+    Without consensus the sharpest frame goes to vision_extract, and if that
+    fails the most frequent local reading is returned.
+    """
+    agree = max(1, min(agree, len(frames)))
+    gate = asyncio.Semaphore(max(1, parallel))
+    settled = threading.Event()
+
+    def read_frame(index: int, contents: bytes) -> Optional[FrameResult]:
+        # A frame that got its slot just as the burst settled is skipped
+        if settled.is_set():
+            return None
+        img, image_bytes = prepare_image(contents, crop_box)
+        prices, text = local_extract(img)
+        return FrameResult(index, image_bytes, prices, text, sharpness(img))
+
+    async def process(index: int, contents: bytes) -> Optional[FrameResult]:
+        async with gate, get_limiter('ocr').slot():
+            running = asyncio.ensure_future(to_thread(read_frame, index, contents))
+            try:
+                return await asyncio.shield(running)
+            except asyncio.CancelledError:
+                # The thread cannot be interrupted, keep the slot until it is done
+                await asyncio.gather(running, return_exceptions=True)
+                raise
+
+    tasks = [asyncio.ensure_future(process(index, contents)) for index, contents in enumerate(frames)]
+    results: List[FrameResult] = []
+    votes: Counter = Counter()
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            try:
+                result = await next_done
+            except Overloaded:
+                raise
+            except Exception as frame_error:
+                logger.warning("Burst frame failed: %s", frame_error)
+                continue
+            results.append(result)
+            if not result.prices:
+                continue
+            key = price_key(result.prices)
+            votes[key] += 1
+            if votes[key] >= agree:
+                logger.info("Burst consensus after %d frame(s): %s", len(results), result.prices)
+                return BurstResult(result.prices, result.text, 'tesseract', len(results), votes[key], result.image_bytes)
+    finally:
+        settled.set()
+        for task in tasks:
+            task.cancel()
+
+    if not results:
+        raise ValueError("No frame of the burst could be decoded")
+
+    logger.info("Burst frames disagree (%d readings), escalating to vision", len(votes))
+    sharpest = max(results, key=lambda result: result.sharpness)
+    try:
+        prices, text = await vision_extract(sharpest.image_bytes)
+        return BurstResult(prices, text, 'vision', len(results), 0, sharpest.image_bytes)
+    except Exception as vision_error:
+        logger.warning("Vision API failed for burst: %s, using majority reading", vision_error)
+
+    if not votes:
+        return BurstResult([], sharpest.text, 'tesseract', len(results), 0, sharpest.image_bytes)
+    # Most votes first, then the reading that found more prices
+    key, count = max(votes.items(), key=lambda item: (item[1], len(item[0])))
+    best = next(result for result in results if result.prices and price_key(result.prices) == key)
+    return BurstResult(best.prices, best.text, 'tesseract-majority', len(results), count, best.image_bytes)
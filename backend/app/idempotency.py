@@ -0,0 +1,119 @@
+"""
+Idempotency keys for retried uploads
+Remembers completed and in-flight requests per Idempotency-Key so a retry gets
+the stored response (or joins the running work) instead of redoing OCR and
+submitting the same prices twice
+"""
+import os
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+
+class IdempotencyConflict(Exception):
+    """Raised when a key is reused for a different request payload"""
+
+
+class _Entry:
+    def __init__(self, fingerprint: str, task: asyncio.Task):
+        self.fingerprint = fingerprint
+        self.task = task
+        self.created = time.monotonic()
+
+
+class IdempotencyStore:
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 3600):
+        """
+        Bounded, TTL-evicted record of idempotent requests
+
+        Args:
+            max_entries: Oldest keys are evicted beyond this many entries
+            ttl_seconds: Keys expire this long after the request started
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self.replayed = 0
+
+    @staticmethod
+    def fingerprint(*parts: Any) -> str:
+        """Hash of the request payload, used to detect key reuse for different requests"""
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(part if isinstance(part, bytes) else repr(part).encode())
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def _evict(self):
+        now = time.monotonic()
+        # Expired keys first (oldest entries come first)
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if now - entry.created <= self.ttl_seconds:
+                break
+            self._entries.popitem(last=False)
+
+        # Then the oldest completed keys beyond max_entries. Work that is still
+        # running is skipped, retries must be able to join it; it is bounded by
+        # the admission limits anyway.
+        excess = len(self._entries) - self.max_entries
+        if excess > 0:
+            completed = [key for key, entry in self._entries.items() if entry.task.done()][:excess]
+            for key in completed:
+                del self._entries[key]
+
+    def _drop_failed(self, key: str, task: asyncio.Task):
+        # Failed requests (errors, overload) are not remembered so a retry runs them again
+        entry = self._entries.get(key)
+        if entry and entry.task is task and (task.cancelled() or task.exception() is not None):
+            del self._entries[key]
+
+    async def run(
+        self,
+        key: str,
+        fingerprint: str,
+        work: Callable[[], Awaitable[Any]]
+    ) -> Tuple[Any, bool]:
+        """
+        Run work once per key.
+        Returns (result, replayed) where replayed is True if the result came
+        from an earlier or concurrent request with the same key.
+        """
+        self._evict()
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry.fingerprint != fingerprint:
+                raise IdempotencyConflict(f"Idempotency-Key '{key}' was already used for a different request")
+            self.replayed += 1
+            return await asyncio.shield(entry.task), True
+
+        # Run as a separate task so the work finishes even if the first client disconnects
+        task = asyncio.ensure_future(work())
+        task.add_done_callback(lambda done: self._drop_failed(key, done))
+        self._entries[key] = _Entry(fingerprint, task)
+        return await asyncio.shield(task), False
+
+    def stats(self) -> dict:
+        in_flight = sum(1 for entry in self._entries.values() if not entry.task.done())
+        return {
+            'keys': len(self._entries),
+            'in_flight': in_flight,
+            'replayed': self.replayed,
+        }
+
+
+_store: Optional[IdempotencyStore] = None
+
+
+def get_idempotency_store() -> IdempotencyStore:
+    """Shared store configured via IDEMPOTENCY_MAX_KEYS / IDEMPOTENCY_TTL_SECONDS"""
+    global _store
+    if _store is None:
+        _store = IdempotencyStore(
+            max_entries=int(os.getenv('IDEMPOTENCY_MAX_KEYS', '1000')),
+            ttl_seconds=float(os.getenv('IDEMPOTENCY_TTL_SECONDS', '3600')),
+        )
+    return _store
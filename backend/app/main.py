@@ -1,5 +1,6 @@
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request, Query, Header, Response, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, FileResponse
 import pytesseract
 from PIL import Image
 import io
@@ -7,16 +8,33 @@ import re
 import os
 import json
 import base64
-from typing import Optional, List
+from typing import Dict, Optional, List, Tuple
 from datetime import datetime
 from dotenv import load_dotenv
-from models import OCRResponse, PriceData
-from tcs_submitter import submit_to_tcs
+from models import (
+    OCRResponse, BurstOCRResponse, PriceData, NearbyPricesResponse, PriceHistoryResponse,
+    SessionPrepareRequest, SessionPrepareResponse
+)
+from accounts import get_account_scheduler
+from session_prepare import get_session_preparer
+from admission import Overloaded, get_limiter, admission_stats
+from agent_budget import recent_runs
+from price_store import get_price_store, BUCKETS
+from idempotency import IdempotencyConflict, get_idempotency_store
+from upload_profile import upload_profile, parse_crop, check_crop, prepare_image, reject_upload_bytes
+from burst import BurstResult, burst_settings, run_burst
+from board_template import get_template_store, read_template, relabel, schedule_learning
+from structured_log import PAYLOAD, get_logger, setup_logging, shutdown_logging, logging_stats, request_id_var
+from profiling import RequestProfile, wants_profile, require_admin, list_profiles, profile_path, to_thread
 import httpx
+import uuid
 
 # Load environment variables
 load_dotenv()
 
+setup_logging()
+logger = get_logger(__name__)
+
 app = FastAPI(title="TCS Benzinpreis OCR API")
 
 # CORS middleware
@@ -26,9 +44,48 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After", "Idempotent-Replayed", "X-Request-ID", "X-Profile-ID"],
 )
 
 
+@app.middleware("http")
+async def request_id_middleware(request: Request, call_next):
+    """Tag all log records of a request with its id (client supplied X-Request-ID or generated)"""
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex[:16]
+    token = request_id_var.set(request_id)
+    # Opt-in profiling (admin only, sampled); costs one header lookup when not requested
+    profile = RequestProfile(request_id) if wants_profile(request) else None
+    try:
+        if profile:
+            profile.start()
+        try:
+            response = await call_next(request)
+        finally:
+            if profile:
+                profile_id = profile.stop()
+    finally:
+        request_id_var.reset(token)
+    response.headers["X-Request-ID"] = request_id
+    if profile:
+        response.headers["X-Profile-ID"] = profile_id
+    return response
+
+
+@app.on_event("shutdown")
+async def flush_logs():
+    shutdown_logging()
+
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    """Fast-fail with 503 and a Retry-After hint when a stage is saturated"""
+    logger.warning("Rejected request: %s", exc)
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc), "stage": exc.stage},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
 
 @app.get("/")
 async def root():
@@ -37,116 +94,515 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "timestamp": datetime.now().isoformat()}
+    return {
+        "status": "healthy",
+        "timestamp": datetime.now().isoformat(),
+        "admission": admission_stats(),
+        "idempotency": get_idempotency_store().stats(),
+        "logging": logging_stats(),
+        "templates": await to_thread(get_template_store().stats)
+    }
+
+
+@app.get("/api/agent/runs")
+async def agent_runs():
+    """Telemetry of recent browser agent runs (steps, tokens, latency, outcome), slowest first"""
+    return {"runs": recent_runs()}
+
+
+@app.get("/api/prices/near", response_model=NearbyPricesResponse)
+async def prices_near(
+    latitude: float = Query(..., ge=-90, le=90),
+    longitude: float = Query(..., ge=-180, le=180),
+    radius_km: float = Query(5.0, gt=0, le=50),
+    max_age_hours: Optional[float] = Query(None, gt=0),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0)
+):
+    """Latest known prices per station within radius_km, nearest first"""
+    prices, total = await to_thread(
+        get_price_store().near, latitude, longitude, radius_km=radius_km, max_age_hours=max_age_hours, limit=limit, offset=offset
+    )
+    return NearbyPricesResponse(prices=prices, total=total, limit=limit, offset=offset)
+
+
+@app.get("/api/prices/history", response_model=PriceHistoryResponse)
+async def prices_history(
+    latitude: float = Query(..., ge=-90, le=90),
+    longitude: float = Query(..., ge=-180, le=180),
+    radius_m: float = Query(50.0, gt=0, le=1000),
+    bucket: str = Query('day'),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = Query(30, ge=1, le=500),
+    offset: int = Query(0, ge=0)
+):
+    """Price trend of the station at the given location, averaged per time bucket (newest first)"""
+    if bucket not in BUCKETS:
+        raise HTTPException(status_code=422, detail=f"bucket must be one of: {', '.join(BUCKETS)}")
+    history = await to_thread(
+        get_price_store().history, latitude, longitude, radius_m=radius_m, bucket=bucket,
+        since=since.timestamp() if since else None,
+        until=until.timestamp() if until else None,
+        limit=limit, offset=offset
+    )
+    return PriceHistoryResponse(bucket=bucket, history=history, limit=limit, offset=offset)
+
+
+@app.get("/api/upload-profile")
+async def get_upload_profile():
+    """Resolution, quality and formats uploads should be encoded with, plus the burst shape"""
+    settings = burst_settings()
+    return {
+        **upload_profile(),
+        'burst': {
+            'frames': min(settings['frames'], settings['max_frames']),
+            'interval_ms': settings['interval_ms'],
+        },
+    }
+
+
+@app.post("/api/session/prepare", response_model=SessionPrepareResponse)
+async def prepare_session(request: SessionPrepareRequest):
+    """
+    Speculatively warm a submission browser at the client's position while the
+    user is still taking the photo. Pass the returned session_id with the upload.
+    """
+    preparer = get_session_preparer()
+    session = await preparer.prepare(request.latitude, request.longitude)
+    if session is None:
+        return SessionPrepareResponse(prepared=False)
+    return SessionPrepareResponse(prepared=True, session_id=session.session_id, expires_in=preparer.ttl)
+
+
+@app.get("/api/accounts")
+async def account_stats():
+    """Per-account submission throughput, load and cooldown state"""
+    return {"accounts": get_account_scheduler().stats(), "prepared_sessions": get_session_preparer().stats()}
+
+
+@app.get("/api/admin/profiles", dependencies=[Depends(require_admin)])
+async def get_profiles():
+    """Stored request profiles, newest first"""
+    return {"profiles": list_profiles()}
+
+
+@app.get("/api/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def get_profile(profile_id: str, format: Optional[str] = Query(None, pattern="^(html|txt|pstats)$")):
+    """Download a profile (HTML flame view from pyinstrument, or cProfile text/pstats)"""
+    path = profile_path(profile_id, format)
+    if not path:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, filename=os.path.basename(path))
 
 
 @app.post("/api/ocr/process", response_model=OCRResponse)
 async def process_image(
+    response: Response,
     image: UploadFile = File(...),
     latitude: Optional[float] = Form(None),
     longitude: Optional[float] = Form(None),
     accuracy: Optional[float] = Form(None),
-    auto_submit: Optional[bool] = Form(False)
+    auto_submit: Optional[bool] = Form(False),
+    crop: Optional[str] = Form(None),
+    session_id: Optional[str] = Form(None),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
     """
     Process an image with OCR to extract fuel prices.
     Optionally auto-submit to TCS website.
+    An optional crop "x,y,width,height" (fractions of the image) limits OCR to the price board.
+    A session_id from /api/session/prepare lets the submission reuse the warm browser.
+    Retries with the same Idempotency-Key header get the stored result
+    instead of running extraction and submission again.
     """
     try:
-        # Read and validate image
-        contents = await image.read()
-        img = Image.open(io.BytesIO(contents))
+        crop_box = parse_crop(crop)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=f"Invalid crop: {e}")
 
-        # Try Vision API first (Qwen Vision via OpenRouter)
-        prices = []
-        text = ""
+    contents = await read_upload(image, crop_box)
 
-        try:
-            prices, text = await vision_extract_prices(contents)
-            print(f"Vision API extraction successful: {prices}")
-        except Exception as vision_error:
-            print(f"Vision API failed: {vision_error}, falling back to Tesseract")
-
-            # Fallback to Tesseract OCR
-            from PIL import ImageEnhance, ImageFilter
-
-            # Strategy 1: Digits-only OCR with aggressive preprocessing
-            img_digits = img.convert('L')
-            img_digits = img_digits.filter(ImageFilter.SHARPEN)
-            enhancer = ImageEnhance.Contrast(img_digits)
-            img_digits = enhancer.enhance(3.0)
-            enhancer = ImageEnhance.Brightness(img_digits)
-            img_digits = enhancer.enhance(1.2)
-            digits_config = r'--oem 3 --psm 6 -c tessedit_char_whitelist=0123456789.'
-            text_digits = pytesseract.image_to_string(img_digits, config=digits_config)
-
-            # Strategy 2: Standard OCR
-            img_standard = img.convert('L')
-            enhancer = ImageEnhance.Contrast(img_standard)
-            img_standard = enhancer.enhance(2.0)
-            standard_config = r'--oem 3 --psm 6'
-            text_standard = pytesseract.image_to_string(img_standard, lang='deu+fra+ita', config=standard_config)
-
-            text = text_digits if len(text_digits.strip()) > len(text_standard.strip()) else text_standard
-            print(f"Tesseract fallback - Selected: {'digits' if text == text_digits else 'standard'}")
-
-            # Extract prices from Tesseract output
-            prices = extract_prices(text)
-
-        # Log the result
-        print(f"OCR processed - Lat: {latitude}, Lng: {longitude}")
-        print(f"Extracted prices: {prices}")
-
-        # Auto-submit to TCS if requested and credentials/cookies are available
-        submission_success = False
+    return await run_idempotent(
+        response,
+        idempotency_key,
+        (contents, latitude, longitude, auto_submit, crop_box, session_id),
+        lambda: run_ocr_pipeline(contents, latitude, longitude, auto_submit, crop_box, session_id)
+    )
+
+
+@app.post("/api/ocr/burst", response_model=BurstOCRResponse)
+async def process_burst(
+    response: Response,
+    images: List[UploadFile] = File(...),
+    latitude: Optional[float] = Form(None),
+    longitude: Optional[float] = Form(None),
+    accuracy: Optional[float] = Form(None),
+    auto_submit: Optional[bool] = Form(False),
+    crop: Optional[str] = Form(None),
+    session_id: Optional[str] = Form(None),
+    agree: Optional[int] = Form(None),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    """
+    Process a short burst of frames of the same price board.
+    Frames are read with Tesseract in parallel and the result is returned as
+    soon as `agree` frames (default BURST_AGREE) read the same prices; only
+    when they disagree is the sharpest frame sent to the vision API.
+    Crop, session_id, auto-submit and Idempotency-Key work as for /api/ocr/process.
+    """
+    settings = burst_settings()
+    if len(images) > settings['max_frames']:
+        raise HTTPException(status_code=422, detail=f"At most {settings['max_frames']} frames per burst")
+    if agree is not None and agree < 1:
+        raise HTTPException(status_code=422, detail="agree must be at least 1")
+    try:
+        crop_box = parse_crop(crop)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=f"Invalid crop: {e}")
+
+    frames = [await read_upload(image, crop_box) for image in images]
+    agree = agree or settings['agree']
+
+    return await run_idempotent(
+        response,
+        idempotency_key,
+        (*frames, latitude, longitude, auto_submit, crop_box, session_id, agree),
+        lambda: run_burst_pipeline(frames, latitude, longitude, auto_submit, crop_box, session_id, agree)
+    )
+
+
+async def read_upload(image: UploadFile, crop_box: Optional[tuple]) -> bytes:
+    """Read an uploaded image, enforcing the hard size limit and a non-empty crop"""
+    contents = await image.read()
+    limit = reject_upload_bytes()
+    if len(contents) > limit:
+        raise HTTPException(status_code=413, detail=f"Image larger than {limit} bytes, see /api/upload-profile")
+    try:
+        check_crop(contents, crop_box)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=f"Invalid crop: {e}")
+    return contents
+
+
+async def run_idempotent(response: Response, idempotency_key: Optional[str], payload: tuple, work):
+    """Run work once per Idempotency-Key; retries with the same payload get the stored result"""
+    if not idempotency_key:
+        return await work()
+
+    store = get_idempotency_store()
+    try:
+        result, replayed = await store.run(idempotency_key, store.fingerprint(*payload), work)
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    if replayed:
+        logger.info("Replayed result for Idempotency-Key %s", idempotency_key)
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+
+async def run_ocr_pipeline(
+    contents: bytes,
+    latitude: Optional[float],
+    longitude: Optional[float],
+    auto_submit: Optional[bool],
+    crop_box: Optional[tuple] = None,
+    session_id: Optional[str] = None
+) -> OCRResponse:
+    """Extract prices from the uploaded image, store them and optionally submit to TCS"""
+    ocr_limiter = get_limiter('ocr')
+    submit_limiter = get_limiter('submission')
+
+    try:
+        # Reject early instead of doing OCR work whose submission would be refused
+        ocr_limiter.ensure_capacity()
         if auto_submit and latitude and longitude:
-            # Try to load cookies from environment (JSON string)
-            tcs_cookies = None
-            tcs_cookies_json = os.getenv('TCS_COOKIES')
-            if tcs_cookies_json:
-                try:
-                    tcs_cookies = json.loads(tcs_cookies_json)
-                except json.JSONDecodeError:
-                    print("Warning: TCS_COOKIES is not valid JSON")
-
-            # Fallback to username/password
-            tcs_username = os.getenv('TCS_USERNAME')
-            tcs_password = os.getenv('TCS_PASSWORD')
-
-            if tcs_cookies or (tcs_username and tcs_password):
-                prices_dict = {
-                    'benzin_95': next((p.value for p in prices if 'benzin' in p.type.lower() and '95' in p.type), None),
-                    'benzin_98': next((p.value for p in prices if 'benzin' in p.type.lower() and '98' in p.type), None),
-                    'diesel': next((p.value for p in prices if 'diesel' in p.type.lower()), None)
-                }
-
-                try:
-                    # Run async submit_to_tcs function
-                    submission_success = await submit_to_tcs(
-                        latitude=latitude,
-                        longitude=longitude,
-                        prices=prices_dict,
-                        cookies=tcs_cookies,
-                        username=tcs_username,
-                        password=tcs_password
-                    )
-                    print(f"TCS submission: {'Success' if submission_success else 'Failed'}")
-                except Exception as submit_error:
-                    print(f"TCS submission error: {str(submit_error)}")
-            else:
-                print("No TCS credentials or cookies available for auto-submit")
+            submit_limiter.ensure_capacity()
+
+        located = latitude is not None and longitude is not None
+        async with ocr_limiter.slot():
+            # Crop and downscale to what the engines need, off the event loop
+            img, image_bytes = await to_thread(prepare_image, contents, crop_box)
+
+            prices = []
+            text = ""
+            confident = False
+
+            # Known board at this station: read just its price rows
+            template = None
+            if located:
+                template, prices = await read_board_template(img, latitude, longitude)
+                text = ' '.join(str(price.value) for price in prices)
+
+        if not prices:
+            # Try Vision API first (Qwen Vision via OpenRouter); network bound, so outside the OCR slot
+            try:
+                prices, text = await limited_vision_extract(image_bytes)
+                logger.info("Vision API extraction successful: %s", prices)
+                confident = True
+            except Exception as vision_error:
+                logger.warning("Vision API failed: %s, falling back to Tesseract", vision_error)
+
+                # Tesseract is CPU bound, keep it off the event loop
+                async with ocr_limiter.slot():
+                    prices, text = await to_thread(tesseract_extract_prices, img)
+
+            if template:
+                prices = relabel(prices, template['rows'])
+
+        # Learn (or relearn) the board layout from a trusted reading
+        if confident and located:
+            schedule_learning(image_bytes, prices, latitude, longitude,
+                              template['station_cell'] if template else None)
+
+        submission = await store_and_submit(prices, latitude, longitude, auto_submit, session_id)
 
         return OCRResponse(
             success=True,
             prices=prices,
             raw_text=text,
-            timestamp=datetime.now().isoformat()
+            timestamp=datetime.now().isoformat(),
+            submission=submission
         )
 
+    except Overloaded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
 
 
+async def read_board_template(
+    img: Image.Image,
+    latitude: float,
+    longitude: float
+) -> Tuple[Optional[Dict], List[PriceData]]:
+    """
+    Read the price rows of the board learned at this position (call under an OCR slot).
+    Returns (template, prices); prices is empty without a template or if a row is
+    unreadable, in which case the caller falls back to the regular engines.
+    """
+    try:
+        template = await to_thread(get_template_store().find, latitude, longitude)
+    except Exception as template_error:
+        logger.warning("Board template lookup failed: %s", template_error)
+        return None, []
+    if not template:
+        return None, []
+
+    try:
+        prices = await to_thread(read_template, img, template['rows']) or []
+    except Exception as template_error:
+        logger.warning("Board template read failed: %s", template_error)
+        prices = []
+    try:
+        await to_thread(get_template_store().record, template['station_cell'], bool(prices))
+    except Exception as template_error:
+        logger.warning("Failed to record board template result: %s", template_error)
+
+    if prices:
+        logger.info("Board template read: %s", prices)
+    return template, prices
+
+
+async def store_and_submit(
+    prices: List[PriceData],
+    latitude: Optional[float],
+    longitude: Optional[float],
+    auto_submit: Optional[bool],
+    session_id: Optional[str] = None
+) -> Optional[str]:
+    """
+    Keep the reading for nearby/history queries and optionally submit it to TCS.
+    Returns the submission outcome ('submitted', 'failed', 'skipped') or None if not requested.
+    """
+    submit_limiter = get_limiter('submission')
+
+    # Log the result
+    logger.info("OCR processed - Lat: %s, Lng: %s", latitude, longitude)
+    logger.info("Extracted prices: %s", prices)
+
+    prices_dict = {
+        'benzin_95': next((p.value for p in prices if 'benzin' in p.type.lower() and '95' in p.type), None),
+        'benzin_98': next((p.value for p in prices if 'benzin' in p.type.lower() and '98' in p.type), None),
+        'diesel': next((p.value for p in prices if 'diesel' in p.type.lower()), None)
+    }
+
+    # Keep the reading for the nearby/history queries
+    if prices and latitude is not None and longitude is not None:
+        try:
+            await to_thread(get_price_store().add, latitude, longitude, **prices_dict)
+        except Exception as store_error:
+            logger.warning("Failed to store prices: %s", store_error)
+
+    # Auto-submit to TCS if requested and credentials/cookies are available
+    submission = None
+    if auto_submit and latitude and longitude:
+        scheduler = get_account_scheduler()
+        submission = 'skipped'
+        if not any(value is not None for value in prices_dict.values()):
+            # Nothing to submit, don't launch a browser or hold on to a warm one
+            logger.info("No prices extracted, skipping TCS submission")
+            if session_id:
+                await get_session_preparer().discard(session_id)
+        elif scheduler.accounts:
+            try:
+                prepared = None
+                if session_id:
+                    prepared = await get_session_preparer().take(session_id, latitude, longitude)
+                if prepared:
+                    # The warm browser already holds a submission slot and its account
+                    try:
+                        submission_success = await scheduler.submit(
+                            latitude=latitude,
+                            longitude=longitude,
+                            prices=prices_dict,
+                            account=prepared.account,
+                            submitter=prepared.submitter
+                        )
+                    finally:
+                        get_session_preparer().done(prepared)
+                else:
+                    # Each submission launches a headless Chromium, bound how many run at once;
+                    # the scheduler then picks a free account from the pool
+                    async with submit_limiter.slot():
+                        submission_success = await scheduler.submit(
+                            latitude=latitude,
+                            longitude=longitude,
+                            prices=prices_dict
+                        )
+                logger.info("TCS submission: %s", 'Success' if submission_success else 'Failed')
+                submission = 'submitted' if submission_success else 'failed'
+            except Overloaded as overloaded:
+                # OCR is done and stored; answer with the reading instead of a 503 that would redo it
+                logger.warning("Submission stage busy (retry after %ss), skipping TCS submission",
+                               overloaded.retry_after)
+            except Exception as submit_error:
+                logger.exception("TCS submission error: %s", submit_error)
+                submission = 'failed'
+        else:
+            logger.warning("No TCS credentials or cookies available for auto-submit")
+
+    # Free a warm browser that will not be used
+    if session_id and not (auto_submit and latitude and longitude):
+        await get_session_preparer().discard(session_id)
+
+    return submission
+
+
+async def run_burst_pipeline(
+    frames: List[bytes],
+    latitude: Optional[float],
+    longitude: Optional[float],
+    auto_submit: Optional[bool],
+    crop_box: Optional[tuple],
+    session_id: Optional[str],
+    agree: int
+) -> BurstOCRResponse:
+    """Find the consensus reading of a burst, store it and optionally submit to TCS"""
+    ocr_limiter = get_limiter('ocr')
+
+    try:
+        ocr_limiter.ensure_capacity()
+        if auto_submit and latitude and longitude:
+            get_limiter('submission').ensure_capacity()
+
+        located = latitude is not None and longitude is not None
+        result = None
+
+        # Known board at this station: its price rows in the first frame are enough
+        template = None
+        if located:
+            try:
+                async with ocr_limiter.slot():
+                    img, image_bytes = await to_thread(prepare_image, frames[0], crop_box)
+                    template, prices = await read_board_template(img, latitude, longitude)
+            except Overloaded:
+                raise
+            except Exception as frame_error:
+                # Undecodable first frame, the burst skips it as well
+                logger.warning("Burst frame failed: %s", frame_error)
+                prices = []
+            if prices:
+                text = ' '.join(str(price.value) for price in prices)
+                result = BurstResult(prices, text, 'template', 1, 0, image_bytes)
+
+        if result is None:
+            # Every frame takes its own OCR slot; BURST_PARALLEL bounds how many one burst uses
+            result = await run_burst(
+                frames,
+                crop_box,
+                agree,
+                burst_settings()['parallel'],
+                tesseract_extract_prices,
+                limited_vision_extract
+            )
+            if template:
+                result.prices = relabel(result.prices, template['rows'])
+
+            # Only a vision reading is trusted to learn the board layout; near-identical
+            # frames can agree on the same Tesseract misread
+            if result.engine == 'vision' and located:
+                schedule_learning(result.image_bytes, result.prices, latitude, longitude,
+                                  template['station_cell'] if template else None)
+
+        submission = await store_and_submit(result.prices, latitude, longitude, auto_submit, session_id)
+
+        return BurstOCRResponse(
+            success=True,
+            prices=result.prices,
+            raw_text=result.text,
+            timestamp=datetime.now().isoformat(),
+            submission=submission,
+            engine=result.engine,
+            frames_received=len(frames),
+            frames_processed=result.frames_processed,
+            agreeing_frames=result.agreeing_frames
+        )
+
+    except Overloaded:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing burst: {str(e)}")
+
+
+def tesseract_extract_prices(img: Image.Image) -> tuple[List[PriceData], str]:
+    """
+    Fallback OCR with Tesseract (blocking, run in a worker thread).
+    Returns (prices, raw_text) tuple.
+    """
+    from PIL import ImageEnhance, ImageFilter
+
+    # Strategy 1: Digits-only OCR with aggressive preprocessing
+    img_digits = img.convert('L')
+    img_digits = img_digits.filter(ImageFilter.SHARPEN)
+    enhancer = ImageEnhance.Contrast(img_digits)
+    img_digits = enhancer.enhance(3.0)
+    enhancer = ImageEnhance.Brightness(img_digits)
+    img_digits = enhancer.enhance(1.2)
+    digits_config = r'--oem 3 --psm 6 -c tessedit_char_whitelist=0123456789.'
+    text_digits = pytesseract.image_to_string(img_digits, config=digits_config)
+
+    # Strategy 2: Standard OCR
+    img_standard = img.convert('L')
+    enhancer = ImageEnhance.Contrast(img_standard)
+    img_standard = enhancer.enhance(2.0)
+    standard_config = r'--oem 3 --psm 6'
+    text_standard = pytesseract.image_to_string(img_standard, lang='deu+fra+ita', config=standard_config)
+
+    text = text_digits if len(text_digits.strip()) > len(text_standard.strip()) else text_standard
+    logger.info("Tesseract fallback - Selected: %s", 'digits' if text == text_digits else 'standard')
+
+    # Extract prices from Tesseract output
+    return extract_prices(text), text
+
+
+async def limited_vision_extract(image_bytes: bytes) -> tuple[List[PriceData], str]:
+    """Vision API call bounded by its own 'vision' stage instead of the CPU-sized OCR stage"""
+    async with get_limiter('vision').slot():
+        return await vision_extract_prices(image_bytes)
+
+
 async def vision_extract_prices(image_bytes: bytes) -> tuple[List[PriceData], str]:
     """
     Use Qwen Vision via OpenRouter to extract fuel prices from LED displays.
@@ -220,7 +676,7 @@ Keine weiteren Erklärungen, nur das JSON."""
 
         result = response.json()
         raw_text = result['choices'][0]['message']['content']
-        print(f"Vision API raw response: {raw_text}")
+        logger.info("Vision API raw response: %s", raw_text, extra=PAYLOAD)
 
         # Parse JSON response
         try:
@@ -274,15 +730,15 @@ def extract_prices(text: str) -> List[PriceData]:
     # Remove whitespace and newlines for cleaner processing
     text_cleaned = ' '.join(text.split())
 
-    # Log OCR text for debugging
-    print(f"OCR Text: {text}")
-    print(f"Cleaned: {text_cleaned}")
+    # Log OCR text for debugging (sampled)
+    logger.info("OCR Text: %s", text, extra=PAYLOAD)
+    logger.info("Cleaned: %s", text_cleaned, extra=PAYLOAD)
 
     # Extract all price-like numbers (format: X.XX or X.XXX or just X.X)
     # Matches: 1.72, 1.80, 1.723, 1.86, etc.
     price_pattern = r'(\d{1,2}\.\d{1,3})'
     found_prices = re.findall(price_pattern, text_cleaned)
-    print(f"Found prices: {found_prices}")
+    logger.info("Found prices: %s", found_prices, extra=PAYLOAD)
 
     # Convert to floats and validate range
     valid_prices = []
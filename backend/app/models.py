@@ -13,6 +13,15 @@ class OCRResponse(BaseModel):
     prices: List[PriceData]
     raw_text: str
     timestamp: str
+    # TCS auto-submit outcome: 'submitted', 'failed' or 'skipped' (None if not requested)
+    submission: Optional[str] = None
+
+
+class BurstOCRResponse(OCRResponse):
+    engine: str
+    frames_received: int
+    frames_processed: int
+    agreeing_frames: int
 
 
 class FuelPriceResponse(BaseModel):
@@ -23,3 +32,41 @@ class FuelPriceResponse(BaseModel):
     benzin_98: Optional[float]
     diesel: Optional[float]
     created_at: datetime
+
+
+class NearbyPriceResponse(FuelPriceResponse):
+    distance_km: float
+
+
+class NearbyPricesResponse(BaseModel):
+    prices: List[NearbyPriceResponse]
+    total: int
+    limit: int
+    offset: int
+
+
+class PriceHistoryBucket(BaseModel):
+    bucket_start: datetime
+    samples: int
+    benzin_95: Optional[float]
+    benzin_98: Optional[float]
+    diesel: Optional[float]
+
+
+class PriceHistoryResponse(BaseModel):
+    bucket: str
+    history: List[PriceHistoryBucket]
+    limit: int
+    offset: int
+
+
+class SessionPrepareRequest(BaseModel):
+    latitude: float
+    longitude: float
+    accuracy: Optional[float] = None
+
+
+class SessionPrepareResponse(BaseModel):
+    prepared: bool
+    session_id: Optional[str] = None
+    expires_in: Optional[float] = None
@@ -0,0 +1,312 @@
+"""
+Fuel price history store
+SQLite time series with a geohash index: every reading is kept in `prices`,
+the newest reading per station cell in `latest_prices` for fast nearby queries
+"""
+import os
+import math
+import time
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# Stored precision: ~150 m cells, used for prefix range scans
+GEOHASH_PRECISION = 7
+# A reading is attributed to a station by its ~38 m x 19 m cell
+STATION_PRECISION = 8
+
+EARTH_RADIUS_KM = 6371.0
+
+BUCKETS = {
+    'hour': 3600,
+    'day': 86400,
+    'week': 7 * 86400,
+}
+
+
+def geohash_encode(latitude: float, longitude: float, precision: int = GEOHASH_PRECISION) -> str:
+    """Encode a coordinate as geohash string"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if longitude >= mid:
+                bits = (bits << 1) | 1
+                lon_range[0] = mid
+            else:
+                bits <<= 1
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= mid:
+                bits = (bits << 1) | 1
+                lat_range[0] = mid
+            else:
+                bits <<= 1
+                lat_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+
+def _cell_size(precision: int) -> Tuple[float, float]:
+    """(lat_degrees, lon_degrees) of a geohash cell"""
+    total_bits = precision * 5
+    lon_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+
+def _bounding_box(latitude: float, longitude: float, radius_km: float) -> Tuple[float, float, float, float]:
+    lat_delta = math.degrees(radius_km / EARTH_RADIUS_KM)
+    lon_delta = lat_delta / max(math.cos(math.radians(latitude)), 1e-6)
+    return latitude - lat_delta, latitude + lat_delta, longitude - lon_delta, longitude + lon_delta
+
+
+def covering_prefixes(min_lat: float, max_lat: float, min_lon: float, max_lon: float, max_cells: int = 16) -> List[str]:
+    """Geohash prefixes whose cells cover the bounding box, as fine as max_cells allows"""
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        lat_step, lon_step = _cell_size(precision)
+        rows = int((max_lat - min_lat) / lat_step) + 2
+        cols = int((max_lon - min_lon) / lon_step) + 2
+        if rows * cols > max_cells * 4 and precision > 1:
+            continue
+
+        prefixes = set()
+        lat = min_lat
+        while True:
+            lon = min_lon
+            while True:
+                prefixes.add(geohash_encode(min(lat, max_lat), min(lon, max_lon), precision))
+                if lon >= max_lon:
+                    break
+                lon += lon_step
+            if lat >= max_lat:
+                break
+            lat += lat_step
+        if len(prefixes) <= max_cells or precision == 1:
+            return sorted(prefixes)
+    return []
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS prices (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    latitude REAL NOT NULL,
+    longitude REAL NOT NULL,
+    geohash TEXT NOT NULL,
+    benzin_95 REAL,
+    benzin_98 REAL,
+    diesel REAL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_prices_geohash_time ON prices (geohash, created_at);
+
+CREATE TABLE IF NOT EXISTS latest_prices (
+    station_cell TEXT PRIMARY KEY,
+    price_id INTEGER NOT NULL,
+    latitude REAL NOT NULL,
+    longitude REAL NOT NULL,
+    geohash TEXT NOT NULL,
+    benzin_95 REAL,
+    benzin_98 REAL,
+    diesel REAL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_latest_geohash ON latest_prices (geohash);
+"""
+
+
+class PriceStore:
+    def __init__(self, path: str):
+        """
+        Args:
+            path: SQLite database file (':memory:' for tests)
+        """
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.executescript(_SCHEMA)
+            self._conn.commit()
+
+    def add(
+        self,
+        latitude: float,
+        longitude: float,
+        benzin_95: Optional[float] = None,
+        benzin_98: Optional[float] = None,
+        diesel: Optional[float] = None,
+        created_at: Optional[float] = None
+    ) -> int:
+        """
+        Store one reading and update the latest prices of its station cell
+        (fuels missing from the reading keep their previous value). Returns the row id.
+        """
+        created_at = created_at if created_at is not None else time.time()
+        geohash = geohash_encode(latitude, longitude, STATION_PRECISION)
+        values = (latitude, longitude, geohash[:GEOHASH_PRECISION], benzin_95, benzin_98, diesel, created_at)
+        with self._lock:
+            cursor = self._conn.execute(
+                'INSERT INTO prices (latitude, longitude, geohash, benzin_95, benzin_98, diesel, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                values
+            )
+            price_id = cursor.lastrowid
+            self._conn.execute(
+                'INSERT INTO latest_prices '
+                '(station_cell, price_id, latitude, longitude, geohash, benzin_95, benzin_98, diesel, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(station_cell) DO UPDATE SET '
+                'price_id = excluded.price_id, latitude = excluded.latitude, longitude = excluded.longitude, '
+                'geohash = excluded.geohash, '
+                # A partial reading (e.g. only diesel) keeps the station's other known prices
+                'benzin_95 = COALESCE(excluded.benzin_95, latest_prices.benzin_95), '
+                'benzin_98 = COALESCE(excluded.benzin_98, latest_prices.benzin_98), '
+                'diesel = COALESCE(excluded.diesel, latest_prices.diesel), '
+                'created_at = excluded.created_at '
+                'WHERE excluded.created_at >= latest_prices.created_at',
+                (geohash, price_id) + values
+            )
+            self._conn.commit()
+        return price_id
+
+    def near(
+        self,
+        latitude: float,
+        longitude: float,
+        radius_km: float = 5.0,
+        max_age_hours: Optional[float] = None,
+        limit: int = 20,
+        offset: int = 0
+    ) -> Tuple[List[Dict], int]:
+        """
+        Latest price per station within radius_km, nearest first.
+        Returns (page, total) tuple.
+        """
+        min_lat, max_lat, min_lon, max_lon = _bounding_box(latitude, longitude, radius_km)
+        min_time = time.time() - max_age_hours * 3600 if max_age_hours else 0
+
+        rows = []
+        with self._lock:
+            for prefix in covering_prefixes(min_lat, max_lat, min_lon, max_lon):
+                rows.extend(self._conn.execute(
+                    'SELECT * FROM latest_prices '
+                    'WHERE geohash >= ? AND geohash < ? '
+                    'AND latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ? AND created_at >= ?',
+                    (prefix, prefix + '{', min_lat, max_lat, min_lon, max_lon, min_time)
+                ).fetchall())
+
+        results = []
+        for row in rows:
+            distance = haversine_km(latitude, longitude, row['latitude'], row['longitude'])
+            if distance <= radius_km:
+                results.append(_row_to_dict(row, id_column='price_id', distance_km=round(distance, 3)))
+        results.sort(key=lambda item: item['distance_km'])
+        return results[offset:offset + limit], len(results)
+
+    def history(
+        self,
+        latitude: float,
+        longitude: float,
+        radius_m: float = 50.0,
+        bucket: str = 'day',
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        limit: int = 30,
+        offset: int = 0
+    ) -> List[Dict]:
+        """
+        Price trend around a station, downsampled into time buckets (newest first).
+        Each bucket holds the average per fuel type and the number of readings.
+        """
+        bucket_seconds = BUCKETS[bucket]
+        min_lat, max_lat, min_lon, max_lon = _bounding_box(latitude, longitude, radius_m / 1000)
+        since = since if since is not None else 0
+        until = until if until is not None else time.time()
+
+        prefixes = covering_prefixes(min_lat, max_lat, min_lon, max_lon)
+        if not prefixes:
+            return []
+        prefix_clause = ' OR '.join(['(geohash >= ? AND geohash < ?)'] * len(prefixes))
+        params: List = []
+        for prefix in prefixes:
+            params.extend([prefix, prefix + '{'])
+
+        query = (
+            'SELECT CAST(created_at / ? AS INTEGER) * ? AS bucket_start, COUNT(*) AS samples, '
+            'AVG(benzin_95) AS benzin_95, AVG(benzin_98) AS benzin_98, AVG(diesel) AS diesel '
+            f'FROM prices WHERE ({prefix_clause}) '
+            'AND latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ? '
+            'AND created_at >= ? AND created_at < ? '
+            'GROUP BY bucket_start ORDER BY bucket_start DESC LIMIT ? OFFSET ?'
+        )
+        with self._lock:
+            rows = self._conn.execute(
+                query,
+                [bucket_seconds, bucket_seconds] + params
+                + [min_lat, max_lat, min_lon, max_lon, since, until, limit, offset]
+            ).fetchall()
+
+        return [
+            {
+                'bucket_start': row['bucket_start'],
+                'samples': row['samples'],
+                'benzin_95': _round_price(row['benzin_95']),
+                'benzin_98': _round_price(row['benzin_98']),
+                'diesel': _round_price(row['diesel']),
+            }
+            for row in rows
+        ]
+
+
+def _round_price(value: Optional[float]) -> Optional[float]:
+    return round(value, 3) if value is not None else None
+
+
+def _row_to_dict(row: sqlite3.Row, id_column: str = 'id', **extra) -> Dict:
+    return {
+        'id': row[id_column],
+        'latitude': row['latitude'],
+        'longitude': row['longitude'],
+        'benzin_95': row['benzin_95'],
+        'benzin_98': row['benzin_98'],
+        'diesel': row['diesel'],
+        'created_at': row['created_at'],
+        **extra,
+    }
+
+
+_store: Optional[PriceStore] = None
+
+
+def get_price_store() -> PriceStore:
+    """Shared store at PRICE_DB_PATH, opened on first use"""
+    global _store
+    if _store is None:
+        _store = PriceStore(os.getenv('PRICE_DB_PATH', 'data/prices.db'))
+    return _store
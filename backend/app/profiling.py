@@ -0,0 +1,213 @@
+"""
+Opt-in per-request profiling
+Admins can ask for a single request to be profiled (X-Profile: 1 header or
+?profile=1) and fetch the result later by request id. Uses the pyinstrument
+sampling profiler when installed, cProfile otherwise. Requests without the
+flag only pay for one header lookup.
+Work the request hands to worker threads via to_thread() (image decoding,
+Tesseract, template reads) is profiled in that thread and merged into the report.
+cProfile hooks the whole event-loop thread, so its report also contains other
+requests that ran concurrently; pyinstrument attributes only this request's task.
+"""
+import io
+import os
+import re
+import random
+import asyncio
+import secrets
+import threading
+import pstats
+import cProfile
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional
+from fastapi import HTTPException, Request
+from structured_log import get_logger
+
+try:
+    from pyinstrument import Profiler
+    from pyinstrument.session import Session
+    from pyinstrument.renderers import HTMLRenderer
+except ImportError:
+    Profiler = None
+
+logger = get_logger(__name__)
+
+_SAFE_ID = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+def _admin_token() -> Optional[str]:
+    return os.getenv('ADMIN_TOKEN') or None
+
+
+def is_admin(request: Request) -> bool:
+    """True if the request carries the ADMIN_TOKEN (Authorization: Bearer or X-Admin-Token)"""
+    token = _admin_token()
+    if not token:
+        return False
+    supplied = request.headers.get('X-Admin-Token')
+    authorization = request.headers.get('Authorization', '')
+    if not supplied and authorization.startswith('Bearer '):
+        supplied = authorization[len('Bearer '):]
+    return bool(supplied) and secrets.compare_digest(supplied, token)
+
+
+def require_admin(request: Request):
+    """FastAPI dependency for admin endpoints"""
+    if not is_admin(request):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
+# Profilers hook the interpreter per thread, so only one request is profiled at a time
+_active = False
+# Profile of the current request, inherited by its tasks and to_thread() calls
+_current: ContextVar[Optional['RequestProfile']] = ContextVar('request_profile', default=None)
+
+
+def wants_profile(request: Request) -> bool:
+    """Cheap check whether this request opted into profiling, then auth and sampling"""
+    if request.headers.get('X-Profile') != '1' and request.query_params.get('profile') != '1':
+        return False
+    if not is_admin(request):
+        return False
+    if _active:
+        logger.info("Profiler busy, not profiling this request")
+        return False
+    return random.random() < float(os.getenv('PROFILE_SAMPLE_RATE', '1.0'))
+
+
+def _profile_dir() -> str:
+    return os.getenv('PROFILE_DIR', '/tmp/tcs-profiles')
+
+
+def _prune(directory: str):
+    keep = int(os.getenv('PROFILE_KEEP', '50'))
+    files = sorted(
+        (os.path.join(directory, name) for name in os.listdir(directory)),
+        key=os.path.getmtime
+    )
+    for path in files[:-keep] if keep > 0 else files:
+        os.remove(path)
+
+
+class RequestProfile:
+    """Profiles the code between start() and stop() and stores the report under the request id"""
+
+    def __init__(self, request_id: str):
+        self.request_id = request_id if _SAFE_ID.match(request_id) else secrets.token_hex(8)
+        self._profiler = self._new_profiler(async_mode='enabled')
+        self._token = None
+        self.running = False
+        # Finished profilers of worker threads, merged into the report on stop()
+        self._thread_profilers: List[Any] = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _new_profiler(async_mode: str):
+        if Profiler is not None:
+            return Profiler(interval=float(os.getenv('PROFILE_INTERVAL', '0.001')), async_mode=async_mode)
+        return cProfile.Profile()
+
+    def start(self):
+        global _active
+        _active = True
+        self._token = _current.set(self)
+        self.running = True
+        if Profiler is not None:
+            self._profiler.start()
+        else:
+            self._profiler.enable()
+
+    def run_in_thread(self, func: Callable, *args, **kwargs):
+        """Run func in the calling worker thread under its own profiler"""
+        profiler = self._new_profiler(async_mode='disabled')
+        if Profiler is not None:
+            profiler.start()
+        else:
+            profiler.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if Profiler is not None:
+                profiler.stop()
+            else:
+                profiler.disable()
+            with self._lock:
+                self._thread_profilers.append(profiler)
+
+    def stop(self) -> str:
+        """Stop profiling and write the report; returns the profile id"""
+        global _active
+        if Profiler is not None:
+            self._profiler.stop()
+        else:
+            self._profiler.disable()
+        _current.reset(self._token)
+        self.running = False
+        _active = False
+        # Threads still running after the response (cancelled burst frames) are left out
+        with self._lock:
+            thread_profilers = list(self._thread_profilers)
+
+        directory = _profile_dir()
+        os.makedirs(directory, exist_ok=True)
+        if Profiler is not None:
+            session = self._profiler.last_session
+            for profiler in thread_profilers:
+                if profiler.last_session is not None:
+                    session = Session.combine(session, profiler.last_session)
+            path = os.path.join(directory, f'{self.request_id}.html')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(HTMLRenderer().render(session))
+        else:
+            stats = pstats.Stats(self._profiler)
+            for profiler in thread_profilers:
+                stats.add(profiler)
+            stats.dump_stats(os.path.join(directory, f'{self.request_id}.pstats'))
+            # Human readable summary next to the binary stats
+            summary = io.StringIO()
+            stats.stream = summary
+            stats.sort_stats('cumulative').print_stats(60)
+            with open(os.path.join(directory, f'{self.request_id}.txt'), 'w', encoding='utf-8') as f:
+                f.write(summary.getvalue())
+
+        _prune(directory)
+        logger.info("Stored profile %s", self.request_id)
+        return self.request_id
+
+
+async def to_thread(func: Callable, *args, **kwargs):
+    """asyncio.to_thread that also profiles the worker thread if the calling request is profiled"""
+    profile = _current.get()
+    # Background work started by the request may outlive it
+    if profile is None or not profile.running:
+        return await asyncio.to_thread(func, *args, **kwargs)
+    return await asyncio.to_thread(profile.run_in_thread, func, *args, **kwargs)
+
+
+def list_profiles() -> List[Dict]:
+    """Stored profiles, newest first"""
+    directory = _profile_dir()
+    if not os.path.isdir(directory):
+        return []
+    entries = []
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        stem, ext = os.path.splitext(name)
+        entries.append({
+            'id': stem,
+            'format': ext.lstrip('.'),
+            'bytes': os.path.getsize(path),
+            'created': os.path.getmtime(path),
+        })
+    return sorted(entries, key=lambda entry: entry['created'], reverse=True)
+
+
+def profile_path(profile_id: str, fmt: Optional[str] = None) -> Optional[str]:
+    """Path of the report for a profile id (HTML flame view, text summary or pstats)"""
+    if not _SAFE_ID.match(profile_id):
+        return None
+    for ext in ([fmt] if fmt else ['html', 'txt', 'pstats']):
+        path = os.path.join(_profile_dir(), f'{profile_id}.{ext}')
+        if os.path.exists(path):
+            return path
+    return None
@@ -0,0 +1,171 @@
+"""
+Speculative browser pre-warming
+When the client opens the camera it reports its position; we reserve an
+account and a submission slot, open benzin.tcs.ch with that geolocation and
+let a short agent run open the nearest station. The OCR request then hands the
+warm browser to the scheduler so only the prices remain to be entered. Unused
+preparations expire and give their account and slot back.
+"""
+import os
+import time
+import asyncio
+import secrets
+from typing import Dict, Optional
+from accounts import AccountScheduler, TCSAccount, get_account_scheduler
+from admission import get_limiter
+from price_store import haversine_km
+from tcs_submitter import TCSSubmitter
+from structured_log import get_logger
+
+logger = get_logger(__name__)
+
+
+class PreparedSession:
+    def __init__(self, session_id: str, latitude: float, longitude: float,
+                 account: TCSAccount, submitter: TCSSubmitter):
+        self.session_id = session_id
+        self.latitude = latitude
+        self.longitude = longitude
+        self.account = account
+        self.submitter = submitter
+        self.created = time.monotonic()
+        self.warm_task: Optional[asyncio.Task] = None
+        self.expiry: Optional[asyncio.TimerHandle] = None
+
+
+class SessionPreparer:
+    def __init__(self, scheduler: AccountScheduler, max_sessions: int = 1,
+                 ttl: float = 45.0, max_distance_m: float = 300.0, keep_free_slots: int = 1):
+        """
+        Args:
+            scheduler: Account pool the warm browsers are reserved from
+            max_sessions: Warm browsers allowed at the same time
+            ttl: Seconds an unused preparation is kept
+            max_distance_m: Upload position must be this close to the prepared one
+            keep_free_slots: Submission slots that warm browsers never take, so
+                uploads without a preparation are not blocked by idle ones
+        """
+        self.scheduler = scheduler
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_distance_m = max_distance_m
+        self.keep_free_slots = keep_free_slots
+        self._sessions: Dict[str, PreparedSession] = {}
+        self.prepared = 0
+        self.used = 0
+        self.expired = 0
+        self.skipped = 0
+
+    async def prepare(self, latitude: float, longitude: float) -> Optional[PreparedSession]:
+        """
+        Start warming a browser in the background.
+        The warm Chromium counts against the submission limiter: a slot is held
+        from here until the session is submitted (see done()) or closed.
+        Best effort: returns None when no warm slot, spare submission slot or account is free.
+        """
+        limiter = get_limiter('submission')
+        if len(self._sessions) >= self.max_sessions or not await limiter.try_acquire(self.keep_free_slots):
+            self.skipped += 1
+            return None
+        account = self.scheduler.reserve_nowait()
+        if account is None:
+            limiter.release()
+            self.skipped += 1
+            return None
+
+        try:
+            submitter = TCSSubmitter(cookies=account.cookies, username=account.username, password=account.password)
+        except Exception as e:
+            logger.warning("Cannot prepare browser: %s", e)
+            limiter.release()
+            await self.scheduler.release(account)
+            return None
+
+        session = PreparedSession(secrets.token_urlsafe(12), latitude, longitude, account, submitter)
+        resolve_station = os.getenv('PREPARE_RESOLVE_STATION', 'true').lower() == 'true'
+        session.warm_task = asyncio.ensure_future(submitter.prepare(latitude, longitude, resolve_station))
+        session.expiry = asyncio.get_running_loop().call_later(
+            self.ttl, lambda: asyncio.ensure_future(self._expire(session.session_id))
+        )
+        self._sessions[session.session_id] = session
+        self.prepared += 1
+        logger.info("Preparing browser %s on account %s", session.session_id, account.name)
+        return session
+
+    async def take(self, session_id: str, latitude: float, longitude: float) -> Optional[PreparedSession]:
+        """
+        Hand over a warm session for submission (waits for warming to finish).
+        The caller submits under the session's submission slot and calls done() afterwards.
+        Returns None, and releases the session, if it is unknown, failed or too far away.
+        """
+        session = self._sessions.pop(session_id, None)
+        if session is None:
+            return None
+        session.expiry.cancel()
+
+        distance_m = haversine_km(latitude, longitude, session.latitude, session.longitude) * 1000
+        ready = distance_m <= self.max_distance_m and await session.warm_task
+        if not ready:
+            logger.info("Prepared browser %s not usable (%.0f m away)", session_id, distance_m)
+            await self._close(session)
+            return None
+
+        self.used += 1
+        return session
+
+    def done(self, session: PreparedSession):
+        """Give back the submission slot of a session returned by take()"""
+        get_limiter('submission').release()
+
+    async def discard(self, session_id: str):
+        """Release a preparation the client no longer needs"""
+        session = self._sessions.pop(session_id, None)
+        if session:
+            session.expiry.cancel()
+            await self._close(session)
+
+    async def _expire(self, session_id: str):
+        session = self._sessions.pop(session_id, None)
+        if session:
+            self.expired += 1
+            logger.info("Prepared browser %s expired unused", session_id)
+            await self._close(session)
+
+    async def _close(self, session: PreparedSession):
+        try:
+            if not session.warm_task.done():
+                session.warm_task.cancel()
+            await asyncio.gather(session.warm_task, return_exceptions=True)
+            await session.submitter.close()
+        finally:
+            get_limiter('submission').release()
+            await self.scheduler.release(session.account)
+
+    def stats(self) -> Dict:
+        return {
+            'warm': len(self._sessions),
+            'prepared': self.prepared,
+            'used': self.used,
+            'expired': self.expired,
+            'skipped': self.skipped,
+        }
+
+
+_preparer: Optional[SessionPreparer] = None
+
+
+def get_session_preparer() -> SessionPreparer:
+    """
+    Shared preparer configured via PREPARE_MAX_SESSIONS / PREPARE_TTL /
+    PREPARE_MAX_DISTANCE_M / PREPARE_KEEP_FREE_SLOTS
+    """
+    global _preparer
+    if _preparer is None:
+        _preparer = SessionPreparer(
+            get_account_scheduler(),
+            max_sessions=int(os.getenv('PREPARE_MAX_SESSIONS', '1')),
+            ttl=float(os.getenv('PREPARE_TTL', '45')),
+            max_distance_m=float(os.getenv('PREPARE_MAX_DISTANCE_M', '300')),
+            keep_free_slots=int(os.getenv('PREPARE_KEEP_FREE_SLOTS', '1')),
+        )
+    return _preparer
@@ -0,0 +1,129 @@
+"""
+Non-blocking structured logging
+Log calls only enqueue the record; a background thread formats it as JSON
+and writes it to stdout. Records carry the request id of the current request
+and verbose payload logs (OCR text, raw model responses) are sampled.
+"""
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import contextvars
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar('request_id', default=None)
+
+# Set extra={'payload': True} on verbose logs so they are sampled
+PAYLOAD = {'payload': True}
+
+
+class _ContextFilter(logging.Filter):
+    """Runs in the calling thread: attach the request id and sample payload logs"""
+
+    def __init__(self, payload_sample_rate: float, payload_max_chars: int):
+        super().__init__()
+        self.payload_sample_rate = payload_sample_rate
+        self.payload_max_chars = payload_max_chars
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, 'payload', False):
+            if random.random() >= self.payload_sample_rate:
+                return False
+            record.msg = str(record.msg)
+            if record.args:
+                record.msg = record.msg % record.args
+                record.args = None
+            if len(record.msg) > self.payload_max_chars:
+                record.msg = record.msg[:self.payload_max_chars] + '...'
+        record.request_id = request_id_var.get()
+        return True
+
+
+class _DroppingQueueHandler(QueueHandler):
+    """Never block the caller: drop records when the queue is full"""
+
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only resolve the message here; JSON and traceback formatting happen on the writer thread
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _DroppingQueueHandler.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        request_id = getattr(record, 'request_id', None)
+        if request_id:
+            entry['request_id'] = request_id
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+_listener: Optional[QueueListener] = None
+
+
+def setup_logging():
+    """Install the queue handler on the root logger and start the writer thread (idempotent)"""
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue: queue.Queue = queue.Queue(maxsize=int(os.getenv('LOG_QUEUE_SIZE', '10000')))
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+
+    queue_handler = _DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(_ContextFilter(
+        payload_sample_rate=float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE', '0.1')),
+        payload_max_chars=int(os.getenv('LOG_PAYLOAD_MAX_CHARS', '2000')),
+    ))
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(name)
+
+
+def logging_stats() -> dict:
+    return {'dropped': _DroppingQueueHandler.dropped}
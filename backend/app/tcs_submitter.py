@@ -5,10 +5,16 @@ Uses browser-use AI agent to automate price submission on benzin.tcs.ch
 import os
 import json
 import asyncio
-from typing import Optional, Dict
+from contextlib import asynccontextmanager, ExitStack
+from typing import Optional, Dict, List
 from browser_use import Agent, BrowserSession
 from langchain_community.chat_models import ChatOpenAI
 from playwright.async_api import async_playwright
+from browser_profile import ResourcePolicy, chromium_args, lease_cache_dir, temp_profile_dir
+from agent_budget import AgentBudget, AgentRunRecorder, agent_settings, session_settings
+from structured_log import get_logger
+
+logger = get_logger(__name__)
 
 
 class TCSSubmitter:
@@ -30,6 +36,21 @@ class TCSSubmitter:
         self.context = None
         self.page = None
         self.playwright = None
+        self.resource_policy = ResourcePolicy.from_env()
+        self.last_resource_report: Optional[Dict] = None
+        self.last_run_record: Optional[Dict] = None
+        # Why the last submit_prices() returned False: 'no_prices', 'login', 'agent' or 'error'
+        self.last_failure: Optional[str] = None
+        # Browser kept open by prepare() for the following submit_prices() call
+        self.prepared_session = None
+        self.prepared_station: Optional[str] = None
+        self._session_stack: Optional[ExitStack] = None
+        # One profile for all agent sessions of this submitter (login, then submit)
+        self._profile_stack: Optional[ExitStack] = None
+        self._profile_dir: Optional[str] = None
+        # Cookies of the agent login, carried into the following sessions
+        self._login_cookies: List[Dict] = []
+        self._logged_in = False
 
         # Get OpenRouter API key from environment
         api_key = os.getenv('OPENROUTER_API_KEY')
@@ -62,11 +83,7 @@ class TCSSubmitter:
 
         self.browser = await self.playwright.chromium.launch(
             headless=self.headless,
-            args=[
-                '--no-sandbox',
-                '--disable-dev-shm-usage',
-                '--disable-gpu',
-            ]
+            args=chromium_args() + self.resource_policy.launch_args()
         )
 
         # Create context with permissions for geolocation
@@ -74,6 +91,7 @@ class TCSSubmitter:
             permissions=['geolocation'],
             viewport={'width': 1920, 'height': 1080}
         )
+        await self.resource_policy.attach(self.context)
 
         self.page = await self.context.new_page()
 
@@ -86,27 +104,30 @@ class TCSSubmitter:
         await self.page.goto('https://benzin.tcs.ch')
         await asyncio.sleep(1)
 
-        # Convert cookies to Playwright format
-        playwright_cookies = []
-        for name, value in self.cookies.items():
-            cookie_dict = {
-                'name': name,
-                'value': value,
-                'domain': '.tcs.ch',
-                'path': '/',
-            }
-            playwright_cookies.append(cookie_dict)
+        playwright_cookies = self._playwright_cookies()
 
         try:
             await self.context.add_cookies(playwright_cookies)
-            print(f"Injected {len(playwright_cookies)} cookies")
+            logger.info("Injected %d cookies", len(playwright_cookies))
         except Exception as e:
-            print(f"Failed to inject cookies: {e}")
+            logger.warning("Failed to inject cookies: %s", e)
 
         # Refresh to apply cookies
         await self.page.reload()
         await asyncio.sleep(1)
 
+    def _playwright_cookies(self) -> List[Dict]:
+        """Convert cookies to Playwright format"""
+        return [
+            {
+                'name': name,
+                'value': value,
+                'domain': '.tcs.ch',
+                'path': '/',
+            }
+            for name, value in (self.cookies or {}).items()
+        ]
+
     async def _set_geolocation(self, latitude: float, longitude: float, accuracy: float = 100):
         """Override browser geolocation"""
         await self.context.set_geolocation({
@@ -115,7 +136,118 @@ class TCSSubmitter:
             "accuracy": accuracy
         })
         await self.context.grant_permissions(['geolocation'])
-        print(f"Set geolocation to: {latitude}, {longitude}")
+        logger.info("Set geolocation to: %s, %s", latitude, longitude)
+
+    async def _open_agent_session(self, **session_kwargs):
+        """
+        Start a lean browser-use BrowserSession for agent runs.
+        Uses this submitter's profile (removed in close()), a leased persistent
+        disk cache and the resource policy; configured cookies and those of an
+        earlier agent login are injected into the context.
+        Sessions are keep_alive: Agent.run would otherwise stop them when it
+        ends, they are closed explicitly in _close_agent_session().
+        """
+        if self._profile_stack is None:
+            self._profile_stack = ExitStack()
+            self._profile_dir = self._profile_stack.enter_context(temp_profile_dir())
+
+        stack = ExitStack()
+        cache_dir = stack.enter_context(lease_cache_dir())
+        # Set headless=True for Docker environments to avoid display issues
+        browser_session = BrowserSession(
+            headless=True,  # Always use headless in Docker
+            disable_security=True,
+            user_data_dir=self._profile_dir,
+            args=chromium_args(cache_dir) + self.resource_policy.launch_args(),
+            keep_alive=True,
+            **session_settings(),
+            **session_kwargs
+        )
+        self.resource_policy.reset_stats()
+        try:
+            await browser_session.start()
+            await self.resource_policy.attach(browser_session.browser_context)
+            cookies = self._playwright_cookies() + self._login_cookies
+            if cookies:
+                await browser_session.browser_context.add_cookies(cookies)
+        except Exception:
+            await browser_session.close()
+            stack.close()
+            raise
+        self._session_stack = stack
+        return browser_session
+
+    async def _close_agent_session(self, browser_session):
+        """Close a session from _open_agent_session and report the bytes/requests saved"""
+        try:
+            # kill() also stops sessions opened with keep_alive=True
+            await browser_session.kill()
+        finally:
+            if self._session_stack:
+                self._session_stack.close()
+                self._session_stack = None
+            self.last_resource_report = self.resource_policy.report()
+            logger.info("Browser resources", extra={'fields': {'resources': self.last_resource_report}})
+
+    @asynccontextmanager
+    async def _agent_browser_session(self, **session_kwargs):
+        """Lean browser-use BrowserSession for one agent run, closed afterwards"""
+        browser_session = await self._open_agent_session(**session_kwargs)
+        try:
+            yield browser_session
+        finally:
+            await self._close_agent_session(browser_session)
+
+    async def prepare(self, latitude: float, longitude: float, resolve_station: bool = True) -> bool:
+        """
+        Speculatively warm a browser for a later submit_prices() call:
+        open benzin.tcs.ch with the given geolocation and, optionally, let a
+        short agent run open the nearest station.
+
+        Returns:
+            True if the browser is ready, False otherwise
+        """
+        try:
+            # Stays open after the prepare agent and is reused by _submit_prepared
+            self.prepared_session = await self._open_agent_session(
+                geolocation={'latitude': latitude, 'longitude': longitude},
+            )
+
+            # Accounts without cookies log in inside the warm browser
+            if not self.cookies and not await self._agent_login(self.prepared_session):
+                logger.warning("Login in prepared browser failed")
+                await self.close()
+                return False
+
+            page = await self.prepared_session.get_current_page()
+            await page.goto('https://benzin.tcs.ch')
+
+            if resolve_station:
+                task = f"""
+                The browser shows benzin.tcs.ch, located at {latitude}, {longitude}.
+                Click on the nearest gas station on the map so its detail panel with the
+                fuel prices and "AKTUALISIEREN" buttons is open.
+                Do NOT change any prices.
+                Finish with the name and address of the opened station.
+                """
+                recorder = AgentRunRecorder('prepare', AgentBudget.from_env('prepare'))
+                agent = Agent(
+                    task=task,
+                    llm=self.llm,
+                    browser_session=self.prepared_session,
+                    **agent_settings()
+                )
+                history = await recorder.run(agent)
+                if recorder.succeeded and history:
+                    self.prepared_station = history.final_result()
+
+            logger.info("Prepared browser at %s, %s (station: %s)", latitude, longitude, self.prepared_station)
+            return True
+
+        except Exception as e:
+            logger.exception("Browser preparation failed: %s", e)
+            await self.close()
+            return False
 
     async def login(self) -> bool:
         """
@@ -126,7 +258,7 @@ class TCSSubmitter:
         try:
             # If cookies are provided, use them instead of login
             if self.cookies:
-                print("Using provided cookies for authentication")
+                logger.info("Using provided cookies for authentication")
                 if not self.browser:
                     await self._init_browser()
                 await self._inject_cookies()
@@ -134,60 +266,64 @@ class TCSSubmitter:
 
             # Otherwise, perform AI-powered login with Azure B2C
             if not self.username or not self.password:
-                print("No cookies or credentials provided")
+                logger.warning("No cookies or credentials provided")
                 return False
 
-            print(f"Logging in with username: {self.username}")
-
-            # Use Browser-Use AI agent to handle Azure B2C login
-            login_task = f"""
-            Navigate to https://benzin.tcs.ch and log in to the TCS website.
-
-            Steps:
-            1. Go to benzin.tcs.ch
-            2. Find and click the "Anmelden" or "Login" button
-            3. You will be redirected to an Azure B2C login page (touringclubsuisseb2c.b2clogin.com)
-            4. Enter the email address: {self.username}
-            5. Enter the password: {self.password}
-            6. Click the login/submit button
-            7. Wait for successful login and redirect back to benzin.tcs.ch
-
-            Important:
-            - The login form may be in German, French, or Italian
-            - Look for fields labeled "E-Mail", "Email", "Benutzername" or similar
-            - Password field may be labeled "Passwort", "Password", "Kennwort" or similar
-            - After successful login, you should be redirected back to the main page
-            - Verify that you see your account name or a "Abmelden" (logout) button
-
-            Stop when you can confirm you are logged in successfully.
-            """
-
-            # Create browser-use BrowserSession
-            # Set headless=True for Docker environments to avoid display issues
-            browser_session = BrowserSession(
-                headless=True,  # Always use headless in Docker
-                disable_security=True,
-            )
+            async with self._agent_browser_session() as browser_session:
+                return await self._agent_login(browser_session)
 
-            agent = Agent(
-                task=login_task,
-                llm=self.llm,
-                browser_session=browser_session,
-            )
+        except Exception as e:
+            logger.exception("Login failed: %s", e)
+            return False
 
-            result = await agent.run()
-            print(f"Login agent result: {result}")
+    async def _agent_login(self, browser_session) -> bool:
+        """Run the Azure B2C login agent in the given browser session"""
+        if not self.username or not self.password:
+            logger.warning("No cookies or credentials provided")
+            return False
 
-            await browser_session.close()
+        logger.info("Logging in with username: %s", self.username)
+
+        # Use Browser-Use AI agent to handle Azure B2C login
+        login_task = f"""
+        Navigate to https://benzin.tcs.ch and log in to the TCS website.
+
+        Steps:
+        1. Go to benzin.tcs.ch
+        2. Find and click the "Anmelden" or "Login" button
+        3. You will be redirected to an Azure B2C login page (touringclubsuisseb2c.b2clogin.com)
+        4. Enter the email address: {self.username}
+        5. Enter the password: {self.password}
+        6. Click the login/submit button
+        7. Wait for successful login and redirect back to benzin.tcs.ch
+
+        Important:
+        - The login form may be in German, French, or Italian
+        - Look for fields labeled "E-Mail", "Email", "Benutzername" or similar
+        - Password field may be labeled "Passwort", "Password", "Kennwort" or similar
+        - After successful login, you should be redirected back to the main page
+        - Verify that you see your account name or a "Abmelden" (logout) button
+
+        Stop when you can confirm you are logged in successfully.
+        """
 
-            print("Login completed by AI agent")
-            return True
+        recorder = AgentRunRecorder('login', AgentBudget.from_env('login'))
+        agent = Agent(
+            task=login_task,
+            llm=self.llm,
+            browser_session=browser_session,
+            **agent_settings()
+        )
+        await recorder.run(agent)
+        self.last_run_record = recorder.record
+        logger.info("Login agent finished: %s", recorder.record['outcome'])
 
-        except Exception as e:
-            print(f"Login failed: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            return False
+        if recorder.succeeded:
+            self._logged_in = True
+            # Session cookies are not written to the profile, keep them for the next session
+            state = await browser_session.browser_context.storage_state()
+            self._login_cookies = state.get('cookies', [])
+        return recorder.succeeded
 
     async def submit_prices(
         self,
@@ -210,9 +346,11 @@ class TCSSubmitter:
         Returns:
             True if submission successful, False otherwise
         """
+        self.last_failure = None
         try:
-            # Login first if not already done
-            if not self.cookies and not await self.login():
+            # Login first if not already done (prepare() may have logged in the warm browser)
+            if not self.cookies and not self._logged_in and not await self.login():
+                self.last_failure = 'login'
                 return False
 
             # Build task description for AI agent
@@ -225,11 +363,15 @@ class TCSSubmitter:
                 price_updates.append(f"Diesel to {diesel} CHF")
 
             if not price_updates:
-                print("No prices to update")
+                logger.info("No prices to update")
+                self.last_failure = 'no_prices'
                 return False
 
             price_text = ", ".join(price_updates)
 
+            if self.prepared_session:
+                return await self._submit_prepared(latitude, longitude, price_text)
+
             task = f"""
             Navigate to benzin.tcs.ch and submit fuel prices for a gas station.
 
@@ -252,39 +394,80 @@ class TCSSubmitter:
             - The GPS location should show stations near: {latitude}, {longitude}
             """
 
-            print(f"Starting AI agent to submit prices: {price_text}")
-            print(f"Location: {latitude}, {longitude}")
+            logger.info("Starting AI agent to submit prices: %s", price_text)
+            logger.info("Location: %s, %s", latitude, longitude)
 
             # Create browser-use BrowserSession with geolocation
-            # Set headless=True for Docker environments to avoid display issues
-            browser_session = BrowserSession(
-                headless=True,  # Always use headless in Docker
-                disable_security=True,
+            recorder = AgentRunRecorder('submit', AgentBudget.from_env('submit'))
+            async with self._agent_browser_session(
                 geolocation={'latitude': latitude, 'longitude': longitude},
-            )
+            ) as browser_session:
+                agent = Agent(
+                    task=task,
+                    llm=self.llm,
+                    browser_session=browser_session,
+                    **agent_settings()
+                )
+
+                await recorder.run(agent)
+            self.last_run_record = recorder.record
+
+            logger.info("AI agent finished: %s", recorder.record['outcome'])
+            if not recorder.succeeded:
+                self.last_failure = 'agent'
+            return recorder.succeeded
+
+        except Exception as e:
+            logger.exception("Price submission failed: %s", e)
+            self.last_failure = 'error'
+            return False
+
+    async def _submit_prepared(self, latitude: float, longitude: float, price_text: str) -> bool:
+        """Enter prices in the browser warmed up by prepare()"""
+        if self.prepared_station:
+            where = f'The detail panel of the station "{self.prepared_station}" should already be open.'
+        else:
+            where = f"Click on the nearest gas station on the map at coordinates {latitude}, {longitude}."
+
+        task = f"""
+        The browser already shows benzin.tcs.ch at the user's location.
+        {where}
+
+        Your task:
+        1. Make sure the detail panel of the nearest station is open
+        2. For this gas station, update the following fuel prices: {price_text}
+        3. Click the "AKTUALISIEREN" (update) button for each fuel type
+        4. Enter the new price in the dialog that appears
+        5. Confirm/save the price update
+        6. Repeat for all fuel types that need updating
+
+        Be careful to update the correct fuel types with the correct prices.
+        """
 
+        logger.info("Submitting prices in prepared browser: %s", price_text)
+        recorder = AgentRunRecorder('submit', AgentBudget.from_env('submit'))
+        try:
             agent = Agent(
                 task=task,
                 llm=self.llm,
-                browser_session=browser_session,
+                browser_session=self.prepared_session,
+                **agent_settings()
             )
+            await recorder.run(agent)
+        finally:
+            await self.close()
+        self.last_run_record = recorder.record
 
-            result = await agent.run()
-
-            print(f"AI agent completed with result: {result}")
-
-            await browser_session.close()
-
-            return True
-
-        except Exception as e:
-            print(f"Price submission failed: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            return False
+        logger.info("AI agent finished: %s", recorder.record['outcome'])
+        if not recorder.succeeded:
+            self.last_failure = 'agent'
+        return recorder.succeeded
 
     async def close(self):
         """Close the browser"""
+        if self.prepared_session:
+            session, self.prepared_session = self.prepared_session, None
+            await self._close_agent_session(session)
         if self.page:
             await self.page.close()
         if self.context:
@@ -294,6 +477,11 @@ class TCSSubmitter:
         self.browser = None
         self.context = None
         self.page = None
+        # Removes the per-submitter profile dir once all its sessions are closed
+        if self._profile_stack:
+            self._profile_stack.close()
+            self._profile_stack = None
+            self._profile_dir = None
 
     async def __aenter__(self):
         """Async context manager entry"""
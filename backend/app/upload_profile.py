@@ -0,0 +1,131 @@
+"""
+Upload profile negotiation
+Tells clients which resolution, quality and formats the extraction engines
+actually use, and brings uploads into that shape (crop, downscale) before OCR
+"""
+import io
+import os
+from typing import Dict, List, Optional, Tuple
+from PIL import Image, features
+
+
+# Longest image edge each engine benefits from; more pixels only cost upload and decode time
+ENGINE_MAX_EDGE = {
+    'vision': 1280,     # Qwen VL downsamples larger images anyway
+    'tesseract': 1600,  # LED digits stay readable at this size
+}
+
+
+def _max_edge() -> int:
+    return int(os.getenv('UPLOAD_MAX_EDGE', max(ENGINE_MAX_EDGE.values())))
+
+
+def max_upload_bytes() -> int:
+    """Size clients should keep uploads under (per image); larger ones are downscaled here"""
+    return int(os.getenv('UPLOAD_MAX_BYTES', str(1024 * 1024)))
+
+
+def reject_upload_bytes() -> int:
+    """
+    Hard limit per image, uploads above it are rejected with 413. Kept well above
+    max_bytes so clients that ignore the profile (older cached PWAs) still work.
+    """
+    return max(max_upload_bytes(), int(os.getenv('UPLOAD_REJECT_BYTES', str(20 * 1024 * 1024))))
+
+
+def _supported_formats() -> List[str]:
+    formats = []
+    if features.check('webp'):
+        formats.append('image/webp')
+    formats.append('image/jpeg')
+    return formats
+
+
+def upload_profile() -> Dict:
+    """Profile clients should encode uploads with"""
+    return {
+        'max_edge': _max_edge(),
+        'quality': float(os.getenv('UPLOAD_QUALITY', '0.8')),
+        'formats': _supported_formats(),
+        'max_bytes': max_upload_bytes(),
+        'crop': True,
+        'engines': ENGINE_MAX_EDGE,
+    }
+
+
+def parse_crop(crop: Optional[str]) -> Optional[Tuple[float, float, float, float]]:
+    """
+    Parse a crop rectangle "x,y,width,height" given as fractions (0..1) of the image.
+    Raises ValueError for malformed or out-of-range rectangles.
+    """
+    if not crop:
+        return None
+    parts = [float(part) for part in crop.split(',')]
+    if len(parts) != 4:
+        raise ValueError("crop must be 'x,y,width,height'")
+    x, y, width, height = parts
+    if not (0 <= x < 1 and 0 <= y < 1 and 0 < width <= 1 and 0 < height <= 1):
+        raise ValueError("crop values must be fractions between 0 and 1")
+    if x + width > 1.0001 or y + height > 1.0001:
+        raise ValueError("crop rectangle exceeds the image")
+    return x, y, width, height
+
+
+def crop_pixels(size: Tuple[int, int], crop: Tuple[float, float, float, float]) -> Tuple[int, int, int, int]:
+    """Pixel box of a fractional crop; raises ValueError if it is smaller than one pixel"""
+    x, y, width, height = crop
+    w, h = size
+    box = (int(x * w), int(y * h), int(min(x + width, 1) * w), int(min(y + height, 1) * h))
+    if box[2] <= box[0] or box[3] <= box[1]:
+        raise ValueError("crop rectangle is smaller than one pixel of the image")
+    return box
+
+
+def check_crop(contents: bytes, crop: Optional[Tuple[float, float, float, float]]):
+    """
+    Validate a crop against the image size (reads only the image header).
+    Raises ValueError for an empty crop; undecodable images are left to prepare_image.
+    """
+    if not crop:
+        return
+    try:
+        size = Image.open(io.BytesIO(contents)).size
+    except OSError:
+        return
+    crop_pixels(size, crop)
+
+
+def prepare_image(contents: bytes, crop: Optional[Tuple[float, float, float, float]] = None) -> Tuple[Image.Image, bytes]:
+    """
+    Decode the upload, apply the crop and downscale to the profile size.
+    Returns (image, encoded_bytes); the original bytes are passed through
+    untouched when nothing had to change.
+    """
+    max_edge = _max_edge()
+    img = Image.open(io.BytesIO(contents))
+    original_format = img.format or 'JPEG'
+    original_size = img.size
+
+    # JPEG can decode at 1/2, 1/4 or 1/8 scale directly, far cheaper than a full decode
+    if img.format == 'JPEG' and not crop and max(img.size) > max_edge * 2:
+        img.draft('RGB', (max_edge, max_edge))
+
+    changed = img.size != original_size
+
+    if crop:
+        img = img.crop(crop_pixels(img.size, crop))
+        changed = True
+
+    if max(img.size) > max_edge:
+        img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        changed = True
+
+    if not changed:
+        return img, contents
+
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    out_format = 'WEBP' if original_format == 'WEBP' else 'JPEG'
+    buffer = io.BytesIO()
+    img.save(buffer, format=out_format, quality=85)
+    return img, buffer.getvalue()
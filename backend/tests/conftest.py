@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The service modules import each other by plain module name (run from backend/app)
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
@@ -0,0 +1,36 @@
+"""Smoke tests for TCSSubmitter construction and cleanup (no browser is started)"""
+import os
+import asyncio
+from contextlib import ExitStack
+import pytest
+
+pytest.importorskip('browser_use')
+pytest.importorskip('langchain_community')
+
+from browser_profile import temp_profile_dir
+from tcs_submitter import TCSSubmitter
+
+
+@pytest.fixture(autouse=True)
+def api_key(monkeypatch):
+    monkeypatch.setenv('OPENROUTER_API_KEY', 'test-key')
+
+
+def test_construct_and_close():
+    submitter = TCSSubmitter(cookies={'session': 'abc'})
+    assert submitter.last_failure is None
+    asyncio.run(submitter.close())
+
+
+def test_close_removes_profile_dir():
+    submitter = TCSSubmitter(username='user@example.com', password='secret')
+    # Same as the first agent session does
+    submitter._profile_stack = ExitStack()
+    submitter._profile_dir = submitter._profile_stack.enter_context(temp_profile_dir())
+    profile_dir = submitter._profile_dir
+    assert os.path.isdir(profile_dir)
+
+    asyncio.run(submitter.close())
+
+    assert not os.path.exists(profile_dir)
+    assert submitter._profile_dir is None
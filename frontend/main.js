@@ -22,10 +22,24 @@ const newScanBtn = document.getElementById('new-scan');
 // State
 let stream = null;
 let capturedImage = null;
+let burstFrames = [];
+let idempotencyKey = null;
+let uploadProfile = null;
+let prepareSessionId = null;
+let prepareRequested = false;
 let coordinates = null;
 let gpsWatchId = null;
 let bestAccuracy = Infinity;
 
+// Fallback if the backend profile cannot be loaded
+const DEFAULT_UPLOAD_PROFILE = {
+    max_edge: 1600,
+    quality: 0.8,
+    formats: ['image/jpeg'],
+    max_bytes: 1024 * 1024,
+    burst: { frames: 1, interval_ms: 150 }
+};
+
 // Event Listeners
 startCameraBtn.addEventListener('click', startCamera);
 captureBtn.addEventListener('click', capturePhoto);
@@ -51,6 +65,9 @@ async function startCamera() {
 
         // Get location
         getLocation();
+
+        // Ask the backend which image size/format it needs
+        loadUploadProfile();
     } catch (error) {
         console.error('Kamera-Fehler:', error);
         alert('Kamera konnte nicht gestartet werden. Bitte Berechtigungen prüfen.');
@@ -81,6 +98,9 @@ function getLocation() {
 
                     console.log(`GPS Update - Accuracy: ${Math.round(currentAccuracy)}m (best: ${Math.round(bestAccuracy)}m)`);
 
+                    // Let the backend warm up a submission browser while the user aims the camera
+                    prepareSession();
+
                     // Update UI with current accuracy
                     if (accuracyWarning) {
                         if (currentAccuracy <= 20) {
@@ -133,6 +153,28 @@ function getLocation() {
     }
 }
 
+// Speculatively prepare TCS submission (only with auto-submit, once per capture)
+async function prepareSession() {
+    const autoSubmitCheckbox = document.getElementById('auto-submit-checkbox');
+    if (prepareRequested || !coordinates || !autoSubmitCheckbox || !autoSubmitCheckbox.checked) {
+        return;
+    }
+    prepareRequested = true;
+    try {
+        const response = await fetch(`${API_URL}/api/session/prepare`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(coordinates)
+        });
+        if (response.ok) {
+            const result = await response.json();
+            prepareSessionId = result.prepared ? result.session_id : null;
+        }
+    } catch (error) {
+        console.log('Session-Vorbereitung fehlgeschlagen:', error);
+    }
+}
+
 // Stop GPS tracking
 function stopGPSTracking() {
     if (gpsWatchId !== null) {
@@ -142,14 +184,70 @@ function stopGPSTracking() {
     }
 }
 
-// Capture photo
-function capturePhoto() {
+// Load upload profile (resolution, quality, formats) from backend
+async function loadUploadProfile() {
+    if (uploadProfile) {
+        return;
+    }
+    try {
+        const response = await fetch(`${API_URL}/api/upload-profile`);
+        if (response.ok) {
+            uploadProfile = await response.json();
+            console.log('Upload-Profil:', uploadProfile);
+        }
+    } catch (error) {
+        console.log('Upload-Profil nicht verfügbar, verwende Standard:', error);
+    }
+}
+
+// Encode canvas in the first format of the profile the browser supports,
+// lowering the quality until the image fits max_bytes (the backend rejects larger uploads)
+function encodeCanvas(profile) {
+    const supported = profile.formats.find(
+        // Browsers fall back to PNG for unsupported formats
+        format => canvas.toDataURL(format, 0.1).startsWith(`data:${format}`)
+    ) || 'image/jpeg';
+
+    let quality = profile.quality;
+    let dataUrl = canvas.toDataURL(supported, quality);
+    while (profile.max_bytes && dataUrlBytes(dataUrl) > profile.max_bytes && quality > 0.3) {
+        quality = Math.round((quality - 0.1) * 10) / 10;
+        dataUrl = canvas.toDataURL(supported, quality);
+    }
+    return dataUrl;
+}
+
+// Decoded size of a base64 data URL
+function dataUrlBytes(dataUrl) {
+    const base64 = dataUrl.slice(dataUrl.indexOf(',') + 1);
+    return Math.floor(base64.length * 3 / 4);
+}
+
+// Capture photo (a short burst if the backend supports it)
+async function capturePhoto() {
+    const profile = uploadProfile || DEFAULT_UPLOAD_PROFILE;
+    const burst = profile.burst || DEFAULT_UPLOAD_PROFILE.burst;
     const context = canvas.getContext('2d');
-    canvas.width = video.videoWidth;
-    canvas.height = video.videoHeight;
 
-    context.drawImage(video, 0, 0, canvas.width, canvas.height);
-    capturedImage = canvas.toDataURL('image/jpeg', 0.9);
+    // Downscale to the size the backend actually uses
+    const scale = Math.min(1, profile.max_edge / Math.max(video.videoWidth, video.videoHeight));
+    canvas.width = Math.round(video.videoWidth * scale);
+    canvas.height = Math.round(video.videoHeight * scale);
+
+    // Several frames of the same board: the backend answers once enough of them agree
+    burstFrames = [];
+    captureBtn.disabled = true;
+    for (let i = 0; i < burst.frames; i++) {
+        if (i > 0) {
+            await new Promise(resolve => setTimeout(resolve, burst.interval_ms));
+        }
+        context.drawImage(video, 0, 0, canvas.width, canvas.height);
+        burstFrames.push(encodeCanvas(profile));
+    }
+    captureBtn.disabled = false;
+    capturedImage = burstFrames[0];
+    // One key per photo: retries of this upload never run OCR/submission twice
+    idempotencyKey = crypto.randomUUID();
 
     // Stop camera
     stopCamera();
@@ -214,13 +312,18 @@ async function uploadPhoto() {
     loadingSection.style.display = 'block';
 
     try {
-        // Convert base64 to blob
-        const response = await fetch(capturedImage);
-        const blob = await response.blob();
+        // Convert base64 to blobs
+        const blobs = await Promise.all(
+            burstFrames.map(frame => fetch(frame).then(response => response.blob()))
+        );
+        const isBurst = blobs.length > 1;
 
         // Create form data
         const formData = new FormData();
-        formData.append('image', blob, 'photo.jpg');
+        blobs.forEach((blob, index) => {
+            const filename = `photo-${index + 1}.${blob.type === 'image/webp' ? 'webp' : 'jpg'}`;
+            formData.append(isBurst ? 'images' : 'image', blob, filename);
+        });
 
         if (coordinates) {
             formData.append('latitude', coordinates.latitude);
@@ -233,10 +336,15 @@ async function uploadPhoto() {
         if (autoSubmitCheckbox && autoSubmitCheckbox.checked) {
             formData.append('auto_submit', 'true');
         }
+        if (prepareSessionId) {
+            formData.append('session_id', prepareSessionId);
+        }
 
-        // Send to backend
-        const apiResponse = await fetch(`${API_URL}/api/ocr/process`, {
+        // Send to backend, retry network errors with the same Idempotency-Key
+        const endpoint = isBurst ? '/api/ocr/burst' : '/api/ocr/process';
+        const apiResponse = await fetchWithRetry(`${API_URL}${endpoint}`, {
             method: 'POST',
+            headers: { 'Idempotency-Key': idempotencyKey },
             body: formData
         });
 
@@ -258,6 +366,21 @@ async function uploadPhoto() {
     }
 }
 
+// Retry on network failures (flaky mobile connections)
+async function fetchWithRetry(url, options, attempts = 3) {
+    for (let attempt = 1; ; attempt++) {
+        try {
+            return await fetch(url, options);
+        } catch (error) {
+            if (attempt >= attempts) {
+                throw error;
+            }
+            console.log(`Upload fehlgeschlagen (Versuch ${attempt}), neuer Versuch...`);
+            await new Promise(resolve => setTimeout(resolve, 1000 * attempt));
+        }
+    }
+}
+
 // Display OCR results
 function displayResults(result) {
     resultsDiv.innerHTML = '';
@@ -296,7 +419,10 @@ function retakePhoto() {
 // New scan
 function newScan() {
     capturedImage = null;
+    burstFrames = [];
     coordinates = null;
+    prepareSessionId = null;
+    prepareRequested = false;
     resultsDiv.innerHTML = '';
 
     resultSection.style.display = 'none';
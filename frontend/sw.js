@@ -1,4 +1,4 @@
-const CACHE_NAME = 'tcs-benzinpreis-v1';
+const CACHE_NAME = 'tcs-benzinpreis-v2';
 const urlsToCache = [
   '/',
   '/index.html',